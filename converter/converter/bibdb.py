@@ -0,0 +1,149 @@
+#-*- file-encoding: utf-8 -*-
+r"""BibTeX databases (``--bibliography``).
+
+biber parses every entry of the bibliography it's handed, which gets slow for
+e.g. Zotero group libraries with thousands of entries. Since we know which
+keys a document cites, we give it just those entries (`filter_bib`), plus the
+entries they inherit from via ``crossref``, ``xref`` or ``xdata``.
+
+Parsing big bibliographies with pybtex is slow as well, so `load` keeps
+parsed databases around, keyed by the digest of the ``.bib``: the most
+recently used ones in memory (which helps servers and batches) and pickled in
+a `DiskCache`, if one is given (``--cache-dir``).
+
+The filtering is done on the BibTeX source text, so entries are passed on
+verbatim:
+
+>>> print filter_bib('''@string{ny = "New York"}
+... @book{parent, title = {Proceedings}, address = ny}
+... @inproceedings{child, crossref = {parent}, author = {A. U. Thor}}
+... @comment{whatever}
+... @article{uncited, title = "Ignored"}
+... ''', ['Child']),
+@string{ny = "New York"}
+@book{parent, title = {Proceedings}, address = ny}
+@inproceedings{child, crossref = {parent}, author = {A. U. Thor}}
+"""
+from collections import OrderedDict
+import cPickle as pickle
+import logging as log
+
+import regex as re
+
+from .digest import hexdigest
+from .diskcache import cache_key
+from . import profiling
+
+ENTRY_REX = re.compile(r'@\s*(\w+)\s*([{(])')
+PARENT_REX = re.compile(
+    r'(?i)(?:^|[,\s])(?:crossref|xref|xdata)\s*=\s*(?:\{([^{}]*)\}|"([^"]*)")')
+
+# how many parsed databases `load` keeps in memory
+MEMORY_SLOTS = 4
+_PARSED = OrderedDict()
+
+
+def load(filename, cache=None):
+    """Parse the BibTeX database `filename` with pybtex, or reuse a parse.
+
+    NB: the result may be shared with earlier and later callers.
+    """
+    import pybtex
+    with open(filename, 'rb') as f:
+        key = cache_key('bibtex', getattr(pybtex, '__version__', ''),
+                        hexdigest(f.read()))
+    if key in _PARSED:
+        profiling.count('bib_cache_hits', 1)
+        _PARSED[key] = bib = _PARSED.pop(key)
+        return bib
+    bib = None
+    cached = cache.get(key) if cache else None
+    if cached:
+        try:
+            bib = pickle.loads(cached['bib'])
+            profiling.count('bib_cache_hits', 1)
+        except (pickle.UnpicklingError, AttributeError, EOFError,
+                ImportError, KeyError) as e:
+            log.warn('Ignoring unreadable cached bibliography %s: %s', key, e)
+    if bib is None:
+        from pybtex.database.input import bibtex
+        with profiling.stage('parse_bibliography'):
+            bib = bibtex.Parser().parse_file(filename)
+        if cache:
+            cache.put(key, {'bib': pickle.dumps(bib, pickle.HIGHEST_PROTOCOL)})
+    _PARSED[key] = bib
+    while len(_PARSED) > MEMORY_SLOTS:
+        _PARSED.popitem(last=False)
+    return bib
+
+
+def split_entries(text):
+    """Yield ``(type, key, entry_text)`` for the entries in BibTeX `text`.
+
+    `type` is lowercased; `key` is None for ``@string``, ``@preamble`` and
+    ``@comment``.
+    """
+    pos = 0
+    while True:
+        m = ENTRY_REX.search(text, pos)
+        if not m:
+            return
+        entry_type = m.group(1).lower()
+        closing = '}' if m.group(2) == '{' else ')'
+        # a ")" in a "quoted" field value doesn't end an @entry(...)
+        depth, quoted, i = 0, False, m.end()
+        while i < len(text):
+            c = text[i]
+            if c == '{':
+                depth += 1
+            elif c == '}' and depth:
+                depth -= 1
+            elif c == '"' and not depth and entry_type != 'comment':
+                quoted = not quoted
+            elif c == closing and not depth and not quoted:
+                break
+            i += 1
+        entry = text[m.start():i+1]
+        key = None
+        if entry_type not in ('string', 'preamble', 'comment'):
+            key = text[m.end():i].split(',', 1)[0].strip()
+        yield entry_type, key, entry
+        pos = i + 1
+
+
+def _parents(entry):
+    for m in PARENT_REX.finditer(entry):
+        for key in (m.group(1) or m.group(2) or '').split(','):
+            if key.strip():
+                yield key.strip().lower()
+
+
+def filter_bib(text, keys):
+    """Return only the entries of BibTeX `text` needed for citing `keys`.
+
+    That's the entries for `keys` and (recursively) their ``crossref``,
+    ``xref`` and ``xdata`` parents, as well as all ``@string`` and
+    ``@preamble`` definitions. Keys are compared case-insensitively, like
+    BibTeX does.
+    """
+    entries = list(split_entries(text))
+    by_key = dict((key.lower(), entry)
+                  for _, key, entry in entries if key is not None)
+    wanted = set()
+    todo = [key.lower() for key in keys]
+    while todo:
+        key = todo.pop()
+        if key in wanted or key not in by_key:
+            continue
+        wanted.add(key)
+        todo.extend(_parents(by_key[key]))
+    return ''.join(entry + '\n' for entry_type, key, entry in entries
+                   if entry_type in ('string', 'preamble')
+                   or key is not None and key.lower() in wanted)
+
+
+def write_filtered(bib_filename, keys, out_filename):
+    with open(bib_filename, 'rb') as f:
+        text = f.read()
+    with open(out_filename, 'wb') as f:
+        f.write(filter_bib(text, keys))
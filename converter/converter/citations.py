@@ -55,3 +55,26 @@ def cleanse_post_citation(post):
         return [re.sub(r'^,?\s*', '', post[0])] + post[1:]
     else:
         return post
+
+
+def cited_keys(x):
+    """Find the keys of all citations in `x`, e.g. a body or meta data.
+
+    >>> body = [('p', {}, ['See ', ('CMD', {'class': ['textcite']}, ['kn84']),
+    ...                    ('CMD', {'class': ['autocite']}, ['lam86', 'p.5'])]),
+    ...         ('CMD', {'class': ['pagebreak']}, [])]
+    >>> sorted(cited_keys(body))
+    ['kn84', 'lam86']
+    """
+    ans = set()
+    todo = [x]
+    while todo:
+        x = todo.pop()
+        if isinstance(x, dict):
+            todo.extend(x.itervalues())
+        elif isinstance(x, (list, tuple)):
+            if (len(x) == 3 and x[0] == 'CMD' and x[2]
+                    and CITE_REX.match(x[1]['class'][0])):
+                ans.add(x[2][0])
+            todo.extend(x)
+    return ans
@@ -0,0 +1,148 @@
+#-*- file-encoding: utf-8 -*-
+r"""A size-bounded, least-recently-used on-disk cache.
+
+Entries are directories of named blobs, keyed by (hex) digests, e.g.::
+
+    cache = DiskCache('/var/cache/typesetr/results', max_bytes=2**30)
+    key = cache_key(input_bytes, style_digest, 'pdf')
+    cached = cache.get(key)
+    if cached is None:
+        cached = {'pdf': make_pdf(), 'diagnostics': diagnostics}
+        cache.put(key, cached)
+    print cached['pdf']
+
+Entries are written to a temporary directory first and then renamed into
+place (and renamed out of the way before they are removed), so several
+processes can safely share a cache. Reading an entry bumps its mtime, which
+is what the LRU eviction goes by. The total size of the entries is kept
+track of in a file next to them, so that storing an entry only has to look
+at all the others once that crosses the limit.
+"""
+import errno
+import fcntl
+import logging as log
+import os
+import shutil
+import tempfile
+
+from .digest import hexdigest
+
+SIZE_FILE = '.size'
+
+
+def cache_key(*parts):
+    """Make a cache key from a sequence of (byte)strings."""
+    return hexdigest('\0'.join(p.encode('utf-8') if isinstance(p, unicode)
+                               else str(p) for p in parts))
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, fn))
+               for d, _, fns in os.walk(path) for fn in fns)
+
+
+class DiskCache(object):
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            try:
+                os.makedirs(root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _path(self, key):
+        assert key.isalnum(), "Bad cache key %r" % key
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the blobs stored under `key` as a dict, or ``None``."""
+        path = self._path(key)
+        blobs = {}
+        try:
+            os.utime(path, None)
+            for name in os.listdir(path):
+                with open(os.path.join(path, name), 'rb') as f:
+                    blobs[name] = f.read()
+        except (OSError, IOError) as e:
+            # missing or evicted while we were reading it
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return blobs
+
+    def put(self, key, blobs):
+        """Store `blobs`, a dict mapping names to bytes, under `key`."""
+        tmp_path = tempfile.mkdtemp(prefix='.tmp', dir=self.root)
+        stored = False
+        try:
+            for name, data in blobs.iteritems():
+                assert os.path.basename(name) == name
+                with open(os.path.join(tmp_path, name), 'wb') as f:
+                    f.write(data)
+            os.rename(tmp_path, self._path(key))
+            stored = True
+        except OSError as e:
+            # someone beat us to it; the entries are interchangeable
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        if stored:
+            added = sum(len(data) for data in blobs.itervalues())
+            size = self._update_size(
+                lambda size: None if size is None else size + added)
+            if size is None or size > self.max_bytes:
+                self.evict()
+
+    def _update_size(self, update):
+        """Replace the recorded total size by ``update(old_size)``.
+
+        `old_size` is None if it's unknown (e.g. for caches that were filled
+        before the size was recorded). Returns the new size.
+        """
+        fd = os.open(os.path.join(self.root, SIZE_FILE),
+                     os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            old_size = os.read(fd, 32)
+            size = update(int(old_size) if old_size.isdigit() else None)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '' if size is None else str(size))
+        finally:
+            os.close(fd) # also releases the lock
+        return size
+
+    def keys(self):
+        """The keys of all entries."""
+        # dot-files are temporary entries and the size file
+        return [name for name in os.listdir(self.root)
+                if not name.startswith('.')]
+
+    def evict(self):
+        """Remove least recently used entries until we're below `max_bytes`."""
+        entries = []
+        for name in self.keys():
+            path = os.path.join(self.root, name)
+            try:
+                entries.append((os.path.getmtime(path), _dir_size(path), name))
+            except OSError: # evicted concurrently
+                continue
+        total = sum(size for (_, size, _) in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            log.debug('Evicting %s from cache', name)
+            # move it out of the way first, so `get` never sees half of it
+            doomed = os.path.join(self.root, '.tmp-evicted-%d-%s' % (
+                os.getpid(), name))
+            try:
+                os.rename(os.path.join(self.root, name), doomed)
+            except OSError: # evicted concurrently
+                pass
+            else:
+                shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+        self._update_size(lambda _: total)
@@ -2,6 +2,7 @@
 #-*- file-encoding: utf-8 -*-
 """Utitlies to produce user-facing error messages."""
 from collections import OrderedDict
+from contextlib import contextmanager
 import logging as log
 
 from converter import exit_code
@@ -77,3 +78,56 @@ def metaproblem(meta):
 def metainfoinfo(meta):
     _parseable_error(OrderedDict([('type', 'meta'),
                                   ('meta', meta)]), level='info')
+
+class _LogRecorder(log.Handler):
+    def __init__(self, level):
+        log.Handler.__init__(self)
+        self.records = []
+        self.other_level = level
+
+    def emit(self, record):
+        # we log to the root logger; other libraries' records are only kept
+        # as far as they'd have been shown anyway
+        if record.name != 'root' and record.levelno < self.other_level:
+            return
+        # make the record picklable, so it can be cached
+        self.records.append(log.makeLogRecord(dict(
+            record.__dict__,
+            msg=record.getMessage(), args=None, exc_info=None,
+            exc_text=record.exc_text or (
+                record.exc_info and
+                log.Formatter().formatException(record.exc_info)))))
+
+@contextmanager
+def recording_log():
+    """Record all log records emitted within the context, down to DEBUG.
+
+    The records get replayed for later runs with possibly higher verbosity,
+    so the root logger is opened up to DEBUG meanwhile; its other handlers
+    are raised to the old level instead, so that what they output is
+    unchanged. Yields the list the records are collected in; see
+    `replay_log`.
+    """
+    root = log.getLogger()
+    old_level = root.level
+    handler_levels = [(handler, handler.level) for handler in root.handlers]
+    outer = [h for h in root.handlers if isinstance(h, _LogRecorder)]
+    recorder = _LogRecorder(outer[-1].other_level if outer else old_level)
+    for handler, level in handler_levels:
+        handler.setLevel(max(level, old_level))
+    root.setLevel(log.DEBUG)
+    root.addHandler(recorder)
+    try:
+        yield recorder.records
+    finally:
+        root.removeHandler(recorder)
+        root.setLevel(old_level)
+        for handler, level in handler_levels:
+            handler.setLevel(level)
+
+def replay_log(records):
+    """Log `records` (see `recording_log`) again, as far as enabled."""
+    root = log.getLogger()
+    for record in records:
+        if root.isEnabledFor(record.levelno):
+            root.handle(record)
@@ -20,6 +20,7 @@ from converter.xml_namespaces import docx_ns as ns
 from converter.postprocess import whack
 from converter.xmltools import tup2etree
 from converter import odt_parser
+from converter import profiling
 
 from converter import literal
 from converter.unparse import unparse_literal
@@ -653,8 +654,10 @@ class Docx(object):
 
 def parse_to_raw_body(infilename, rewritten_input=None,
                       make_transclusions=None):
-    doc = Docx(infilename, make_transclusions)
-    raw_body, transclusions = doc.parse()
+    with profiling.stage('preparse'):
+        doc = Docx(infilename, make_transclusions)
+    with profiling.stage('parse_body'):
+        raw_body, transclusions = doc.parse()
     rewrite_info = (rewritten_input, doc)
     return (raw_body, transclusions, rewrite_info)
 
@@ -3,9 +3,6 @@ from collections import OrderedDict, Counter
 import datetime
 import logging as log
 
-import pybtex
-from pybtex.exceptions import PybtexError
-import pybtex.database
 import regex as re
 
 from converter.internal import mkel
@@ -75,6 +72,9 @@ class Person(object):
         if not self.little_endian:
             # FIXME(alexander): horrible hack to westernize names
             self._sanitized = " ".join(self._sanitized.split(' ', 1)[::-1])
+        # pybtex is slow to import and only needed for names
+        import pybtex.database
+        from pybtex.exceptions import PybtexError
         try:
             # pylint: disable=C0103
             self._p = pybtex.database.Person(self._sanitized)
@@ -18,6 +18,25 @@ META_ERROR_EXIT, BODY_ERROR_EXIT, MISSING_INCLUDES_EXIT = (
     2**i | DATA_ERROR_EXIT for i in range(1, 4))
 INTERNAL_ERROR_EXIT, USAGE_ERROR_EXIT = range(1, 3)
 
+def combine(codes):
+    """Combine the exit codes of several conversions into one.
+
+    Any bug (non-data error) wins over all data errors, an internal error
+    over the rest; otherwise the data errors are `|`-ed together.
+
+    >>> combine([0, META_ERROR_EXIT, BODY_ERROR_EXIT]) == (
+    ...     META_ERROR_EXIT | BODY_ERROR_EXIT)
+    True
+    >>> combine([BODY_ERROR_EXIT, INTERNAL_ERROR_EXIT, USAGE_ERROR_EXIT])
+    1
+    """
+    codes = list(codes)
+    bugs = [code for code in codes if code and not code & DATA_ERROR_EXIT]
+    if bugs:
+        return (INTERNAL_ERROR_EXIT if INTERNAL_ERROR_EXIT in bugs
+                else max(bugs))
+    return reduce(lambda a, b: a | b, codes, 0)
+
 # mutated from outside
 final_exit_code=0 # pylint: disable=C0322,C0103
 
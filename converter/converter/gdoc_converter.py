@@ -20,51 +20,58 @@ Bugs of this converter:
 # pylint: disable=W0622
 
 import argparse
+import copy
+import cPickle as pickle
 from cStringIO import StringIO
 from functools import partial
+from multiprocessing.pool import ThreadPool
+import errno
 import glob
+import importlib
 import json
 import logging as log
+import multiprocessing
 import os
 import pprint
 import shutil
 import stat
+import struct
 import subprocess
 import sys
 import tempfile
 import zipfile
+import zlib
 
-from pybtex.database.input import bibtex
 import regex as re
 
+from . import bibdb
+from .citations import cited_keys
+from .digest import hexdigest
+from .diskcache import DiskCache, cache_key
 from .docerror import missing_include
 from . import docerror
 from . import exit_code
 from .internal import shared
+from . import latexbuild
 from . import orderedyaml as yaml # pylint: disable=E0611
 from . import postprocess
+from . import profiling
+from . import scheduler
 from . import stytempl
-from .transclusions import Transclusions
+from . import texformat
+from .transclusions import Transclusions, print_widths_cm
 
-from . import html_parser
-from . import docx_parser
-from . import odt_parser
-from . import markdown_parser
+# Parsers and writers (and their dependencies, some of which are slow to
+# import) are only loaded once an input or output format needs them.
+WRITERS = {'epub': 'epub_writer',
+           'html': 'html_writer',
+           'internal': 'internal_writer',
+           'meta': 'meta_writer',
+           'tex': 'latex_writer',
+           'pickle': 'pickle_writer'}
 
-from . import epub_writer
-from . import html_writer
-from . import internal_writer
-from . import latex_writer
-from . import meta_writer
-from . import pickle_writer
-
-from .docxlite import is_possibly_docx
-
-
-WRITERS = dict((m.__name__.split('.')[-1].split('_')[0].replace('latex', 'tex'),
-                m.write)
-               for m in [epub_writer, html_writer, internal_writer,
-                         meta_writer, latex_writer, pickle_writer])
+def _load(module_name):
+    return importlib.import_module('.' + module_name, __package__)
 
 
 
@@ -72,53 +79,166 @@ def parsed_body_to_internal(head, parsed_body, out_file):
     print >> out_file, pprint.pformat((head, parsed_body))
 
 
-def process(infilename, meta_schema, # pylint: disable=R0913,R0914
-            make_transclusions,
-            bibliography,
-            asides,
-            update_meta,
-            rewritten_input):
+def parse(infilename, make_transclusions, bibliography, asides,
+          rewritten_input):
+    """Parse and postprocess `infilename`, i.e. everything style independent.
+
+    Returns ``(maybe_meta, unaugmented_meta, body, transclusions, rewrite)``,
+    where `maybe_meta` is the meta data from a markdown header, if any, and
+    `rewrite` writes out the input with updated meta data.
+    """
+    maybe_meta = None
     if infilename.lower().endswith('.docx'):
-        pmod = docx_parser
+        pmod = _load('docx_parser')
     elif infilename.lower().endswith('.odt'):
-        pmod = odt_parser
+        pmod = _load('odt_parser')
     elif infilename.lower().endswith('.html'):
-        pmod = html_parser
+        pmod = _load('html_parser')
     elif infilename.lower().rsplit('.', 1)[1] in ('md', 'txt', 'markdown'):
-        maybe_meta, infilename = markdown_parser.to_html(infilename)
-        update_meta = update_meta or maybe_meta
-        pmod = html_parser
+        with profiling.stage('markdown'):
+            maybe_meta, infilename = _load('markdown_parser').to_html(
+                infilename)
+        pmod = _load('html_parser')
     else:
         assert False, "Unknown input type %s" % infilename.split('.')[-1]
     raw_body, transclusions, rewrite_info = pmod.parse_to_raw_body(
         infilename, rewritten_input, make_transclusions)
-    unaugmented_meta, body = postprocess.postprocess(
-        raw_body, transclusions, bibliography=bibliography, asides=asides)
+    with profiling.stage('postprocess'):
+        unaugmented_meta, body = postprocess.postprocess(
+            raw_body, transclusions, bibliography=bibliography, asides=asides)
+    def rewrite(meta):
+        pmod.rewrite_input(meta, unaugmented_meta, transclusions,
+                           asides, rewrite_info)
+    return maybe_meta, unaugmented_meta, body, transclusions, rewrite
+
+def cached_parse(stage_cache, key, **kwargs):
+    """Like `parse`, but reuses earlier results from `stage_cache`.
+
+    Diagnostics and error counts of the original parse are replayed on a
+    cache hit; the diagnostics are recorded down to DEBUG, so a run with
+    higher verbosity than the original one gets to see them all. Cached
+    results have no `rewrite`, which is only needed for --new-meta anyway.
+    """
+    cached = stage_cache.get(key)
+    if cached:
+        log.debug('Using cached parse %s', key)
+        profiling.count('stage_cache_hits', 1)
+        (records, error_count, exit_bits,
+         maybe_meta, unaugmented_meta, body, transclusions) = pickle.loads(
+             cached['parse'])
+        docerror.replay_log(records)
+        docerror.ERROR_COUNT += error_count
+        exit_code.final_exit_code |= exit_bits
+        return maybe_meta, unaugmented_meta, body, transclusions, None
+    error_count = docerror.ERROR_COUNT
+    with docerror.recording_log() as records:
+        parsed = parse(**kwargs)
+    stage_cache.put(key, {'parse': pickle.dumps(
+        (records, docerror.ERROR_COUNT - error_count,
+         exit_code.final_exit_code) + parsed[:-1],
+        pickle.HIGHEST_PROTOCOL)})
+    return parsed
+
+def process(parsed, meta_schema, bibliography, update_meta):
+    maybe_meta, unaugmented_meta, body, transclusions, rewrite = parsed
+    if maybe_meta is not None:
+        update_meta = update_meta or maybe_meta
     if update_meta is None:
         meta = meta_schema.validate_and_augment(unaugmented_meta)
     else:
         meta = meta_schema.validate_and_augment(update_meta)
         # FIXME(alexander): not sure why this is called on `update_meta`
         # and not *just* on `rewritten_input`
-        pmod.rewrite_input(meta, unaugmented_meta, transclusions,
-                           asides, rewrite_info)
+        if rewrite:
+            rewrite(meta)
     # FIXME(alexander): useful for now, but should be removed at some point
     assert not shared(body), "Ooopsy, accidentally caused some aliasing"
 
     if meta.items().get('bibliography') and not bibliography:
         link = meta.items()['bibliography'].to_string()
         missing_include('bibliography', link)
-    transclusions.provide()
     return meta, body, transclusions
 
-def make_pdf(tex_filename, style_template):
+def make_pdf(tex_filename, style_template, # pylint: disable=R0913
+             build_dir=None, preview=False, pdf_cache=None):
+    """Build the pdf for `tex_filename`, in `build_dir` if given.
+
+    Any other files latex needs must be next to `tex_filename`; with a
+    `build_dir`, they are synced into it first (see `latexbuild`), and the
+    pdf is copied back. A `preview` is just a single, approximate latex pass
+    (see ``styles/shared/latex/makepreview``). If the same sources were built
+    before, the pdf is taken from `pdf_cache`, if given.
+    """
+    if not pdf_cache:
+        return _build_pdf(tex_filename, style_template, build_dir, preview)
+    key = _pdf_key(tex_filename, style_template, preview)
+    out_filename = tex_filename.replace('.tex', '.pdf')
+    cached = pdf_cache.get(key)
+    if cached:
+        log.debug('Using cached pdf %s', key)
+        profiling.count('pdf_cache_hits', 1)
+        with open(out_filename, 'wb') as f:
+            f.write(cached['pdf'])
+    else:
+        _build_pdf(tex_filename, style_template, build_dir, preview)
+        with open(out_filename, 'rb') as f:
+            pdf_cache.put(key, {'pdf': f.read()})
+    return out_filename
+
+def _pdf_key(tex_filename, style_template, preview):
+    """Everything that can influence the built pdf."""
+    tex_dir = os.path.dirname(tex_filename)
+    links, digests = [], []
+    for d, _, fns in os.walk(tex_dir):
+        for fn in fns:
+            path = os.path.join(d, fn)
+            if path == tex_filename or fn in ('makepdf', 'makepreview'):
+                continue
+            if os.path.islink(path):
+                # include files, the format and the like link into the styles
+                links.append(os.path.relpath(path, tex_dir) + ':' +
+                             os.readlink(path))
+            else:
+                # other files (images, chapters...) are only identified by
+                # their contents, since e.g. an input file from stdin has a
+                # random name
+                digests.append(_file_digest(path))
+    return cache_key(
+        # the generated latex, which also names the files it uses
+        _file_digest(tex_filename),
+        # the style files, makepdf and makepreview included
+        style_template.hexdigest(),
+        # a single, approximate pass or the real thing
+        preview,
+        # the other files next to the latex
+        *(sorted(links) + sorted(digests)))
+
+def _build_pdf(tex_filename, style_template, build_dir, preview):
+    if preview:
+        return _make_pdf(tex_filename, style_template, 'makepreview')
+    if not build_dir:
+        return _make_pdf(tex_filename, style_template)
+    with latexbuild.locked(build_dir):
+        changed = latexbuild.sync_tree(os.path.dirname(tex_filename),
+                                       build_dir)
+        log.debug('Building in %s, %d files changed', build_dir, changed)
+        profiling.count('latex_build_files_changed', changed)
+        built = _make_pdf(
+            os.path.join(build_dir, os.path.basename(tex_filename)),
+            style_template)
+        out_filename = tex_filename.replace('.tex', '.pdf')
+        shutil.copy(built, out_filename)
+    return out_filename
+
+def _make_pdf(tex_filename, style_template, script_name='makepdf'):
     out_dir = os.path.dirname(tex_filename)
     out_filename = tex_filename.replace('.tex', '.pdf')
-    log.debug('make_pdf %s to %s', tex_filename, out_filename)
+    log.debug('%s %s to %s', script_name, tex_filename, out_filename)
 
-    makepdf_path = write_build_pdf_script(style_template, tex_filename)
+    makepdf_path = write_build_pdf_script(style_template, tex_filename,
+                                          script_name)
     try:
-        subprocess.check_call([makepdf_path], cwd=out_dir, stdout=sys.stderr)
+        scheduler.build([makepdf_path], cwd=out_dir, stdout=sys.stderr)
     except:
         subprocess.call(['cat', tex_filename.replace('.tex', '.log')],
                         cwd=out_dir,
@@ -126,13 +246,20 @@ def make_pdf(tex_filename, style_template):
         raise
     return out_filename
 
-def write_build_pdf_script(style_template, tex_filename):
-    script_name = 'makepdf'
+def write_build_pdf_script(style_template, tex_filename,
+                           script_name='makepdf'):
     styles_base = style_template.base_path
     script_template = os.path.join(styles_base, 'shared', 'latex', script_name)
     script_file = os.path.join(os.path.dirname(tex_filename), script_name)
     target_tex = os.path.basename(tex_filename)
 
+    # a persistent build dir still has the (read-only) script of the last
+    # build, which we can't open for writing
+    try:
+        os.unlink(script_file)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
     with open(script_template) as template:
         script_tmpl = template.read().decode('utf-8')
         interpolated = script_tmpl.replace('INTERPOLATETARGET', target_tex)
@@ -144,28 +271,89 @@ def write_build_pdf_script(style_template, tex_filename):
     return script_file
 
 def make_png(pdf_filename, page_number, size):
+    return make_pngs(pdf_filename, [page_number], size, processes=1)[0]
+
+def make_pngs(pdf_filename, pages, size, processes):
+    """Render `pages` of a pdf to files named ``<pdf prefix>-<page>.png``.
+
+    Consecutive pages are rendered by the same pdftoppm process, and the
+    pages are split across up to `processes` of them. Returns the png file
+    names, in the order of `pages`.
+    """
     out_dir = os.path.dirname(pdf_filename)
     out_pattern, _ = os.path.splitext(pdf_filename)
-    log.debug('make_png %s to %s', pdf_filename, out_pattern)
-    subprocess.check_call(['pdftoppm', '-f', str(page_number),
-                           '-l', str(page_number),
-                           '-scale-to', str(size), '-png',
-                           pdf_filename, out_pattern],
-                          cwd=out_dir,
-                          stdout=sys.stderr)
-    #fix pdftoppm sometimes putting 0s before the page number (01 -> 1)
-    files = glob.glob(out_pattern + '-*%d.png' % page_number)
-    out_file = out_pattern + '-%d.png' % page_number
-
-    assert len(files) != 0, \
-        'Cannot locate generated preview file - expected %s' % out_file
-    if len(files) > 1:
-        log.error('Expected one preview picture, got %s', str(files))
-
-    preview = files[0]
-    if preview != out_file:
-        shutil.move(preview, out_file)
-    return out_file
+    log.debug('make_pngs %s to %s', pdf_filename, out_pattern)
+    def render((first, last)):
+        subprocess.check_call(['pdftoppm', '-f', str(first),
+                               '-l', str(last),
+                               '-scale-to', str(size), '-png',
+                               pdf_filename, out_pattern],
+                              cwd=out_dir,
+                              stdout=sys.stderr)
+    runs = _page_runs(sorted(set(pages)), processes)
+    with profiling.stage('make_png'):
+        if len(runs) == 1:
+            render(runs[0])
+        else:
+            pool = ThreadPool(min(processes, len(runs)))
+            try:
+                pool.map(render, runs)
+            finally:
+                pool.close()
+    #fix pdftoppm putting 0s before the page number (01 -> 1), depending
+    #on the number of pages
+    page_rex = re.compile(re.escape(os.path.basename(out_pattern)) +
+                          r'-0*(\d+)\.png$')
+    for fn in os.listdir(out_dir):
+        m = page_rex.match(fn)
+        if m and fn != '%s-%s.png' % (os.path.basename(out_pattern),
+                                      m.group(1)):
+            shutil.move(os.path.join(out_dir, fn),
+                        '%s-%s.png' % (out_pattern, m.group(1)))
+    out_files = ['%s-%d.png' % (out_pattern, page) for page in pages]
+    missing = [fn for fn in out_files if not os.path.exists(fn)]
+    assert not missing, \
+        'Cannot locate generated preview file(s) - expected %s' % missing
+    return out_files
+
+def _page_runs(pages, processes):
+    """Split sorted `pages` into runs of consecutive pages for each process.
+
+    >>> _page_runs([1, 2, 3, 4, 5, 6, 7, 9], 2)
+    [(1, 4), (5, 7), (9, 9)]
+    """
+    chunk = -(-len(pages) // processes)
+    runs = []
+    for i in range(0, len(pages), chunk):
+        for page in pages[i:i+chunk]:
+            if runs and runs[-1][1] == page - 1 and page != pages[i]:
+                runs[-1] = (runs[-1][0], page)
+            else:
+                runs.append((page, page))
+    return runs
+
+def pdf_page_count(pdf_filename):
+    info = subprocess.check_output(['pdfinfo', pdf_filename])
+    return int(re.search(r'(?m)^Pages:\s+(\d+)', info).group(1))
+
+def _zip_pages(png_filenames, zip_filename):
+    with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_STORED) as archive:
+        for fn in png_filenames:
+            archive.write(fn, os.path.basename(fn))
+    return zip_filename
+
+def mark_png(png_filename, keyword, text):
+    """Add a ``tEXt`` chunk with `keyword` and `text` to a png file."""
+    with open(png_filename, 'rb') as f:
+        data = f.read()
+    chunk = 'tEXt' + keyword + '\0' + text
+    # the signature and the IHDR chunk always come first
+    ihdr_end = 8 + 4 + struct.unpack('>I', data[8:12])[0] + 8
+    with open(png_filename, 'wb') as f:
+        f.write(data[:ihdr_end])
+        f.write(struct.pack('>I', len(chunk) - 4) + chunk +
+                struct.pack('>I', zlib.crc32(chunk) & 0xffffffff))
+        f.write(data[ihdr_end:])
 
 def _should_update_meta(new_meta):
     if not new_meta:
@@ -201,7 +389,7 @@ def _provide_infile(infile, tmp_dir):
     contents = sys.stdin.read()
     if odt_check(contents):
         suffix = '.odt'
-    elif is_possibly_docx(contents):
+    elif _load('docxlite').is_possibly_docx(contents):
         suffix = '.docx'
     elif contents.startswith('<'):
         suffix = '.html'
@@ -226,6 +414,8 @@ def _write_archive(out_file, format, style_template, tmp_dir):
             dirs.sort()
             fns.sort()
             for fn in fns:
+                if fn == texformat.FORMAT_FILE: # big and only for makepdf
+                    continue
                 archive.write(os.path.join(root, fn), fn)
         if format == 'html': # XXX: abstract that
             for n, path in style_template.includes_for(format).iteritems():
@@ -234,8 +424,8 @@ def _write_archive(out_file, format, style_template, tmp_dir):
         sys.stdout.write(out_file.getvalue())
 
 
-def _maybe_clean(clean, tmp_dir, out_file, rewritten_input):
-    if out_file is not sys.stdout:
+def _maybe_clean(clean, tmp_dir, out_file, out_prefix, rewritten_input):
+    if out_file not in (None, sys.stdout):
         out_file.close()
     if rewritten_input:
         rewritten_input.close()
@@ -245,59 +435,333 @@ def _maybe_clean(clean, tmp_dir, out_file, rewritten_input):
     else:
         print >> sys.stderr, "Not cleaning up."
         print >> sys.stderr, "Worked in %s, output to %s." % (
-            tmp_dir, out_file.name)
+            tmp_dir, out_file.name if out_file else out_prefix + '.*')
+
+def _format_extension(format):
+    return format if format != 'meta' else 'yml'
 
-def _provide_outfile(in_filename, out_filename, format, packaging):
+def _provide_outfile(in_filename, out_filename, formats, packaging):
+    """Returns the output file, the output prefix, formats and packaging.
+
+    If several output `formats` are requested, the output file is ``None``;
+    every output then goes into a file of its own, named after the output
+    prefix (see `_provide_format_outfile`).
+    """
     if out_filename and out_filename != '-':
         out_prefix, ext = os.path.splitext(out_filename)
         if ext == '.zip':
             packaging = packaging or 'zip'
             out_prefix, ext = os.path.splitext(out_prefix)
-        out_file = open(out_filename, 'wb')
-        if not format:
-            format = ext[1:] if ext != '.yml' else 'meta'
+        if not formats:
+            formats = [ext[1:] if ext != '.yml' else 'meta']
+        if len(formats) == 1:
+            out_file = open(out_filename, 'wb')
+        else:
+            out_file = None
+            if ext[1:] not in map(_format_extension, formats):
+                out_prefix += ext
     else:
         out_prefix, _ = os.path.splitext(in_filename)
-        out_file = sys.stdout
-        format = format or 'pdf'
-    return out_file, out_prefix, format, packaging
+        formats = formats or ['pdf']
+        out_file = sys.stdout if len(formats) == 1 else None
+    return out_file, out_prefix, formats, packaging
+
+def _several_pages(page):
+    """Whether --page asks for a zip of pngs (rather than a single png)."""
+    return page == 'all' or len(page) > 1
 
-def _output_it(mbt, out_file, tmp_dir,  # pylint: disable=R0913
+def _provide_format_outfile(out_prefix, format, packaging, page):
+    zipped = packaging == 'zip' or format == 'png' and _several_pages(page)
+    return open('%s.%s%s' % (out_prefix, _format_extension(format),
+                             '.zip' if zipped else ''), 'wb')
+
+def _deliver(data, format, out_file, out_prefix, packaging, page):
+    if out_file is not None:
+        out_file.write(data)
+    else:
+        with _provide_format_outfile(out_prefix, format, packaging,
+                                     page) as format_out_file:
+            format_out_file.write(data)
+
+def _output_it(mbt, format, out_file, tmp_dir,  # pylint: disable=R0913
                out_prefix, style_template, args, bib):
+    if format == 'png' and args.preview:
+        mbt = (mbt[0], mbt[1][:args.preview], mbt[2])
+    transclusions = mbt[2]
+    transclusions.out_dir = (tmp_dir if (format in ('pdf', 'png')
+                                         or args.packaging == 'zip')
+                             else None)
+    # previews are built with draft graphics, so we can skip that there
+    if args.image_dpi and format in ('tex', 'pdf', 'png') and not (
+            format == 'png' and args.preview):
+        with profiling.stage('print_images'):
+            transclusions.provide(
+                print_widths_cm(mbt[1], getattr(transclusions, 'textwidth_cm',
+                                                None)),
+                args.image_dpi, _image_cache(args))
+    else:
+        transclusions.provide()
     tmp_prefix = os.path.join(tmp_dir, os.path.basename(out_prefix))
-    out_ext = args.format if args.format not in ('png', 'pdf') else 'tex'
+    out_ext = format if format not in ('png', 'pdf') else 'tex'
     tmp_outfilename = tmp_prefix + '.' + out_ext
     with open(tmp_outfilename, 'wb') as tmp_outfile:
         result_f = tmp_outfilename
-        if args.format in ('tex', 'pdf', 'png'):
-            style_template.copy_latex_includes(tmp_dir)
+        if format in ('tex', 'pdf', 'png'):
+            style_template.link_latex_includes(tmp_dir)
             if args.bibliography:
-                shutil.copy(args.bibliography,
-                            os.path.join(tmp_dir, 'bibliography.bib'))
-        write = WRITERS[out_ext]
+                # biber only needs to see the entries we actually cite
+                bibdb.write_filtered(args.bibliography,
+                                     cited_keys([mbt[0].d, mbt[1]]),
+                                     os.path.join(tmp_dir, 'bibliography.bib'))
+        if out_ext == 'tex':
+            # the chapters only make it into the output via pdfs or zips
+            latex_writer = _load('latex_writer')
+            latex_writer.SPLIT_CHAPTERS = args.split_chapters and (
+                format != 'tex' or args.packaging == 'zip')
+            latex_writer.PROCESSES = args.latexify_jobs
+        write = _load(WRITERS[out_ext]).write
         #log.debug('%s %r to %r', write.__name__, odt_filename, tmp_outfilename)
-        write(tmp_outfile, style_template, bib, *mbt)
-    if args.format in ('pdf', 'png'):
-        result_f = make_pdf(tmp_outfilename, style_template)
-        if args.format == 'png':
-            result_f = make_png(result_f, args.page, args.pixels)
+        with profiling.stage('writer.' + out_ext):
+            write(tmp_outfile, style_template, bib, *mbt)
+    if format in ('pdf', 'png'):
+        texformat.provide(style_template, mbt[0].items()['lang'].to_babel(),
+                          tmp_dir)
+        if args.split_chapters and args.include_only not in (None, 'all'):
+            _include_only(tmp_outfilename, args.include_only,
+                          _latex_build_dir(args))
+        result_f = make_pdf(tmp_outfilename, style_template,
+                            build_dir=_latex_build_dir(args),
+                            preview=format == 'png' and args.preview,
+                            pdf_cache=_pdf_cache(args))
+        if format == 'png':
+            pages = (range(1, pdf_page_count(result_f) + 1)
+                     if args.page == 'all' else args.page)
+            pngs = make_pngs(result_f, pages, args.pixels, args.jobs)
+            if args.preview:
+                for png in pngs:
+                    mark_png(png, 'Typesetr', 'approximate preview')
+            if not _several_pages(args.page):
+                result_f, = pngs
+            elif args.packaging != 'zip':
+                result_f = _zip_pages(pngs, tmp_prefix + '-pages.zip')
 
     if args.packaging == 'zip':
-        _write_archive(out_file, args.format, style_template, tmp_dir)
+        _write_archive(out_file, format, style_template, tmp_dir)
     else:
         with open(result_f, 'rb') as result:
             out_file.write(result.read())
 
+def _include_only(tex_filename, chapters, build_dir):
+    """Restrict the build of the split `tex_filename` to `chapters`."""
+    latex_writer = _load('latex_writer')
+    tex_dir = os.path.dirname(tex_filename)
+    files = sorted(os.path.basename(fn) for fn in glob.glob(
+        os.path.join(tex_dir, latex_writer.CHAPTER_GLOB)))
+    if chapters == 'changed':
+        if not build_dir:
+            return # everything's new
+        files = latexbuild.changed_files(tex_dir, build_dir, files)
+    else:
+        files = [fn for (i, fn) in enumerate(files, 1) if i in chapters]
+    # if none of them changed, the front or back matter did
+    if files:
+        log.debug('Only building %s', ', '.join(files))
+        latexbuild.include_only(tex_filename,
+                                [os.path.splitext(fn)[0] for fn in files])
+
+def _latex_build_dir(args):
+    if args.latex_build_dir and args.doc_id:
+        return latexbuild.build_dir(args.latex_build_dir, args.doc_id,
+                                    args.style)
+    return None
+
+def _output_all(mbt, out_file, tmp_dir,  # pylint: disable=R0913
+                out_prefix, style_template, args, bib, collect):
+    """Write `mbt` out in all of ``args.format``.
+
+    If `collect` is true, also returns a dict mapping each format to its
+    output.
+    """
+    artifacts = {}
+    parse_error_count = docerror.ERROR_COUNT
+    for format in args.format:
+        # make docproblem numbering independent of the other formats
+        docerror.ERROR_COUNT = parse_error_count
+        if out_file is not None:
+            format_mbt, format_dir = mbt, tmp_dir
+        else:
+            # writers mutate the body, so each format gets a fresh copy
+            format_mbt = copy.deepcopy(mbt[:2]) + (mbt[2],)
+            format_dir = os.path.join(tmp_dir, format)
+            os.mkdir(format_dir)
+        if collect:
+            sio = StringIO()
+            _output_it(format_mbt, format, sio, format_dir, out_prefix,
+                       style_template, args, bib)
+            artifacts[format] = sio.getvalue()
+            _deliver(artifacts[format], format, out_file, out_prefix,
+                     args.packaging, args.page)
+        elif out_file is not None:
+            _output_it(format_mbt, format, out_file, format_dir, out_prefix,
+                       style_template, args, bib)
+        else:
+            with _provide_format_outfile(out_prefix, format, args.packaging,
+                                         args.page) as format_out_file:
+                _output_it(format_mbt, format, format_out_file, format_dir,
+                           out_prefix, style_template, args, bib)
+    return artifacts
+
+_CODE_DIGEST = None
+def _code_digest():
+    """A digest of the converter's source, so upgrades invalidate caches."""
+    global _CODE_DIGEST # pylint: disable=W0603
+    if _CODE_DIGEST is None:
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        parts = []
+        for fn in sorted(glob.glob(os.path.join(src_dir, '*.py'))):
+            with open(fn, 'rb') as f:
+                parts.append(f.read())
+        _CODE_DIGEST = hexdigest('\0'.join(parts))
+    return _CODE_DIGEST
+
+def _file_digest(filename):
+    if not filename:
+        return ''
+    with open(filename, 'rb') as f:
+        return hexdigest(f.read())
 
+def _result_cache(args, update_meta):
+    # --new-meta and friends are too stateful to be worth caching; what
+    # --include-only changed builds depends on the latex build dir
+    if (not args.cache_dir or update_meta is not None or args.no_clean
+            or args.error != 'log' or args.include_only == 'changed'):
+        return None
+    return DiskCache(os.path.join(args.cache_dir, 'results'),
+                     max_bytes=args.cache_size * 2**20)
+
+def _stage_cache(args):
+    if not args.cache_dir or args.new_meta or args.error != 'log':
+        return None
+    return DiskCache(os.path.join(args.cache_dir, 'stages'),
+                     max_bytes=args.cache_size * 2**20)
+
+def _pdf_cache(args):
+    if not args.cache_dir:
+        return None
+    return DiskCache(os.path.join(args.cache_dir, 'pdf'),
+                     max_bytes=args.cache_size * 2**20)
+
+def _bib_cache(args):
+    if not args.cache_dir:
+        return None
+    return DiskCache(os.path.join(args.cache_dir, 'bibliographies'),
+                     max_bytes=args.cache_size * 2**20)
+
+def _image_cache(args):
+    if not args.cache_dir:
+        return None
+    return DiskCache(os.path.join(args.cache_dir, 'images'),
+                     max_bytes=args.cache_size * 2**20)
+
+def _stage_key(args, infilename):
+    """Everything that can influence the postprocessed document."""
+    return cache_key(_code_digest(),
+                     _file_digest(infilename),
+                     os.path.splitext(infilename)[1].lower(),
+                     _file_digest(args.bibliography),
+                     args.asides,
+                     args.lofi)
+
+def _result_key(args, style_template, infilename):
+    """Everything that can influence the output of a conversion."""
+    return cache_key(_code_digest(),
+                     _file_digest(infilename),
+                     args.style,
+                     style_template.hexdigest(),
+                     ','.join(args.format),
+                     args.packaging,
+                     _file_digest(args.bibliography),
+                     args.lofi,
+                     args.asides,
+                     args.page,
+                     args.pixels,
+                     args.preview,
+                     args.image_dpi,
+                     args.split_chapters,
+                     args.include_only,
+                     json.dumps(json.loads(args.gdoc_meta), sort_keys=True))
 
-def parse_args():
+def _rename_zipped(data, old_name, new_name):
+    """Rename the files named after `old_name` in the zip `data`.
+
+    That's the output file and latex's auxiliary files (``old_name.*``) and
+    the pages of pngs (``old_name-<page>.png``).
+    """
+    named = re.compile(re.escape(old_name) + r'[.-]').match
+    out = StringIO()
+    with zipfile.ZipFile(StringIO(data)) as old, \
+            zipfile.ZipFile(out, 'w') as new:
+        for info in old.infolist():
+            contents = old.read(info)
+            if named(info.filename):
+                info.filename = new_name + info.filename[len(old_name):]
+            new.writestr(info, contents)
+    return out.getvalue()
+
+def _replay_result(cached, formats, out_file, out_prefix, packaging, page):
+    # the output prefix isn't part of the key, but it names the files inside
+    # zips
+    name = os.path.basename(out_prefix)
+    docerror.replay_log(pickle.loads(cached['diagnostics']))
+    for format in formats:
+        data = cached[format]
+        if name != cached['name'] and (
+                packaging == 'zip' or
+                format == 'png' and _several_pages(page)):
+            data = _rename_zipped(data, cached['name'], name)
+        _deliver(data, format, out_file, out_prefix, packaging, page)
+    exit_code.final_exit_code = int(cached['exit_code'])
+
+
+FORMATS = ('tex', 'pdf', 'png', 'html', 'epub', 'meta', 'internal', 'pickle')
+
+def _format_list(s):
+    formats = []
+    for format in s.split(','):
+        if format not in formats:
+            formats.append(format)
+    bad = [format for format in formats if format not in FORMATS]
+    if bad:
+        raise argparse.ArgumentTypeError(
+            'invalid format(s): %s (choose from %s)' % (
+                ', '.join(bad), ', '.join(FORMATS)))
+    return formats
+
+def _page_list(s):
+    if s == 'all':
+        return s
+    pages = []
+    try:
+        for part in s.split(','):
+            first, _, last = part.partition('-')
+            pages.extend(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid page list: %r' % s)
+    if not pages or min(pages) < 1:
+        raise argparse.ArgumentTypeError('invalid page list: %r' % s)
+    return sorted(set(pages))
+
+def _chapter_list(s):
+    return s if s == 'changed' else _page_list(s)
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     arg = parser.add_argument
 
-    arg("--format", "-f",
-        choices=['tex', 'pdf', 'png', 'html', 'epub', 'meta',
-                 'internal', 'pickle'],
-        help="The output format you'd like to convert to")
+    arg("--format", "-f", type=_format_list,
+        help=("The output format you'd like to convert to (%s); several"
+              " comma-separated formats can be produced from a single"
+              " parse, e.g. 'html,epub,pdf'" % ", ".join(FORMATS)))
     arg("infile", nargs='?', default=sys.stdin,
         help='The odt file to convert (default: stdin)')
     arg("outfile", nargs='?',
@@ -306,10 +770,18 @@ def parse_args():
         help="The style (&type) of document to create")
     arg('--style-base', default='/opt/typesetr/styles',
         help='where to find the styles')
-    arg('--page', type=int, default=1,
-        help="One-based index of the page to render")
+    arg('--page', type=_page_list, default='1',
+        help=("One-based index of the page to render, or several pages as"
+              " comma-separated indices and ranges (e.g. 1-3,7) or 'all';"
+              " several pages (or 'all') are delivered as a zip of numbered"
+              " pngs"))
     arg('--pixels', type=int, default=600,
         help="PNG image size")
+    arg('--preview', metavar='N', type=int,
+        help=("Render a fast, approximate png from just the first N"
+              " top-level blocks of the body, with a single latex pass (no"
+              " bibliography, cross references or images); the png is"
+              " marked as such with a 'Typesetr' text chunk"))
     arg('--no-clean', action="store_true", default=False,
         help="Do not remove temporary files after success.")
     arg("--gdoc-meta", default='{}',
@@ -322,6 +794,10 @@ def parse_args():
         help=("In combination w/ --new-meta: write out an updated input file"))
     arg("--lofi", action="store_true",
         help="Rescale all images to very low resolution; for testing only.")
+    arg("--image-dpi", metavar='DPI', type=int, default=0,
+        help=("Scale images in LaTeX output (and pdfs) down to this resolution"
+              " at their printed size, e.g. 300 (default: 0, i.e. keep them as"
+              " they are)"))
     arg("--zip", dest='packaging', action="store_const", const='zip',
         help="Package the output up in a zip archive")
     arg("--bibliography", "-b",
@@ -334,27 +810,151 @@ def parse_args():
         dest='verbose', action="store_false")
     arg("--error", default='log', choices=['log', 'raise', 'debug'],
         help="For debugging: what to do on document errors")
-    return parser.parse_args()
+    arg("--serve", metavar='SOCKET',
+        help=("Run as a long-lived conversion server, accepting jobs"
+              " on the unix domain socket SOCKET"))
+    arg("--batch", metavar='MANIFEST',
+        help=("Run all the jobs in MANIFEST, a file with one JSON object"
+              " like {\"args\": [gdoc-to args...]} per line"))
+    arg("--fork", action='store_true',
+        help=("With --serve, preload all modules and styles and run each job"
+              " in a forked child of the server, serving up to --jobs"
+              " connections concurrently"))
+    arg("--jobs", "-j", type=int, default=multiprocessing.cpu_count(),
+        help=("Number of worker processes for --batch, concurrent"
+              " connections for --serve --fork, or pdftoppm processes for"
+              " several --page(s) (default: numcores)"))
+    arg("--cache-dir", metavar='DIR',
+        help=("Cache conversion results, parsed documents, bibliographies,"
+              " print images and pdfs in DIR and reuse them for identical"
+              " inputs, styles and options"
+              " (default: no caching)"))
+    arg("--cache-size", metavar='MB', type=int, default=1024,
+        help=("Evict least recently used entries from each cache"
+              " (results, parsed documents, bibliographies, images, pdfs)"
+              " beyond this size"))
+    arg("--latex-build-dir", metavar='DIR',
+        help=("Build pdfs in a persistent per-document (and style) directory"
+              " below DIR, so that latex can reuse the .aux, .bbl, .toc etc."
+              " files of earlier runs (default: build from scratch)"))
+    arg("--latex-jobs", metavar='N', type=int,
+        default=multiprocessing.cpu_count(),
+        help=("Run at most N latex builds at a time, across all gdoc-to"
+              " processes sharing --latex-lock-dir (default: numcores)"))
+    arg("--latex-lock-dir", metavar='DIR', default=scheduler.DEFAULT_LOCK_DIR,
+        help="Where the latex build slots live (default: %(default)s)")
+    arg("--latex-timeout", metavar='SECONDS', type=int, default=0,
+        help=("Kill latex builds that take longer than SECONDS"
+              " (default: 0, i.e. no limit)"))
+    arg("--latex-memory", metavar='MB', type=int,
+        help=("Limit the address space of every latex build process"
+              " (default: no limit)"))
+    arg("--latexify-jobs", metavar='N', type=int, default=1,
+        help=("Generate the LaTeX for the top-level sections of the body in"
+              " N processes (default: 1); the output is the same"))
+    arg("--split-chapters", action="store_true",
+        help=("Write each top-level section of the LaTeX output to a file of"
+              " its own, pulled in with \\include (for pdf, png and zipped"
+              " tex output); NB: \\include starts every section on a new"
+              " page"))
+    arg("--include-only", metavar='CHAPTERS', type=_chapter_list,
+        help=("With --split-chapters: only build these chapters (e.g."
+              " '2,5-7') into the pdf, or those that 'changed' since the"
+              " last build in --latex-build-dir; cross references to the"
+              " others still work with the kept .aux files"))
+    arg("--doc-id", metavar='ID',
+        help=("Identifies the document for --latex-build-dir (default: the"
+              " absolute input file name)"))
+    arg("--profile-json", metavar='FILE',
+        help=("Write per-stage wall/CPU time and peak memory usage, as well"
+              " as document statistics, to FILE as JSON"))
+    return parser.parse_args(argv)
 
 def set_log_level(v):
     # wouldn't it be nice if logging just exposed an ordered list of levels?
     log.basicConfig(level=max(log.CRITICAL-v*10, log.DEBUG))
 
-def main():
-    exit_code.final_exit_code = 0 # hack for consecutive ipython runs
-    args = parse_args()
+_STYLE_TEMPLATES = {}
+def load_style_template(style_base, style, gdoc_meta):
+    """Like `StyleTemplate`, but memoized for long-lived (server) processes.
+
+    Only the style is memoized (and reloaded if its files change); the
+    document's `gdoc_meta` is applied to a fresh copy for every call.
+    """
+    key = (style_base, style)
+    template = _STYLE_TEMPLATES.get(key)
+    if template is None or template.changed_on_disk():
+        template = _STYLE_TEMPLATES[key] = stytempl.StyleTemplate(
+            style_base, style, gdoc_meta={})
+    return template.for_document(gdoc_meta)
+
+def main(argv=None):
+    args = parse_args(argv)
     set_log_level(args.verbose)
+    if args.serve:
+        from . import server
+        if args.fork:
+            server.serve_forked(args.serve, args.style_base, args.jobs)
+        else:
+            server.serve(args.serve)
+    elif args.batch:
+        from . import jobs
+        sys.exit(jobs.run_batch(args.batch, args.jobs))
+    else:
+        convert(args)
+
+def convert(args):
+    profiling.reset()
+    try:
+        _convert(args)
+    finally:
+        if args.profile_json:
+            profiling.dump(args.profile_json,
+                           infile=getattr(args.infile, 'name', args.infile),
+                           formats=args.format,
+                           style=args.style,
+                           exit_code=exit_code.final_exit_code)
+
+def _convert(args):
+    exit_code.final_exit_code = 0 # hack for consecutive ipython runs
+    docerror.ERROR_COUNT = 0
 
     docerror.ON_ERROR = args.error
+    scheduler.SLOTS = args.latex_jobs
+    scheduler.LOCK_DIR = args.latex_lock_dir
+    scheduler.TIMEOUT = args.latex_timeout or None
+    scheduler.MEMORY_MB = args.latex_memory
+
+    if (args.outfile and args.outfile.lower().endswith('.png')
+            and args.format in (None, ['png']) and _several_pages(args.page)
+            and args.packaging != 'zip'):
+        print >> sys.stderr, ("Several --page(s) make a zip of pngs, not a"
+                              " .png; pass --zip or another output file name")
+        sys.exit(exit_code.USAGE_ERROR_EXIT)
 
     update_meta = _should_update_meta(args.new_meta)
     rewritten_input = _should_rewrite_input(args.rewritten_input, update_meta)
 
     args.style = stytempl.ensure_style_exists(args.style_base, args.style)
 
-    style_template = stytempl.StyleTemplate(
+    style_template = load_style_template(
         args.style_base, args.style, gdoc_meta=json.loads(args.gdoc_meta))
 
+    if args.split_chapters and args.include_only not in (None, 'all'):
+        with open(style_template.latex_template) as f:
+            if latexbuild.BEGIN_DOCUMENT not in f.read():
+                print >> sys.stderr, (
+                    "--include-only needs a LaTeX template with a %s, which"
+                    " %s lacks" % (latexbuild.BEGIN_DOCUMENT,
+                                   style_template.latex_template))
+                sys.exit(exit_code.USAGE_ERROR_EXIT)
+
+    if (len(args.format or []) > 1 and not args.outfile
+            and args.infile in ('-', sys.stdin)):
+        print >> sys.stderr, ("Several formats need an output file prefix"
+                              " when reading from stdin")
+        sys.exit(exit_code.USAGE_ERROR_EXIT)
+
     tmp_dir = tempfile.mkdtemp(prefix='typesetr')
     infilename = _provide_infile(args.infile, tmp_dir)
     out_file, out_prefix, args.format, args.packaging = _provide_outfile(
@@ -362,26 +962,70 @@ def main():
 
     log.info("Using dir %s files: %s %s", tmp_dir, args.infile, args.outfile)
 
-    bib = args.bibliography and (bibtex.Parser().parse_file(args.bibliography))
+    if args.latex_build_dir and not args.doc_id:
+        if args.infile in ('-', sys.stdin):
+            log.warn("--latex-build-dir needs a --doc-id for stdin input;"
+                     " building from scratch")
+        else:
+            args.doc_id = os.path.abspath(infilename)
+
+    result_cache = _result_cache(args, update_meta)
+    if result_cache:
+        key = _result_key(args, style_template, infilename)
+        cached = result_cache.get(key)
+    else:
+        cached = None
+
+    if cached:
+        log.debug('Using cached result %s', key)
+        profiling.count('result_cache_hits', 1)
+        _replay_result(cached, args.format, out_file, out_prefix,
+                       args.packaging, args.page)
+    else:
+        with docerror.recording_log() as diagnostics:
+            artifacts = _convert_document(
+                infilename, out_file, tmp_dir, out_prefix, style_template,
+                args, update_meta, rewritten_input,
+                collect=bool(result_cache))
+        if result_cache:
+            artifacts.update(diagnostics=pickle.dumps(
+                diagnostics, pickle.HIGHEST_PROTOCOL),
+                             exit_code=str(exit_code.final_exit_code),
+                             name=os.path.basename(out_prefix))
+            result_cache.put(key, artifacts)
+    _maybe_clean(not args.no_clean, tmp_dir=tmp_dir, out_file=out_file,
+                 out_prefix=out_prefix, rewritten_input=rewritten_input)
+    exit_code.exit()
+
+def _convert_document(infilename, out_file, tmp_dir, # pylint: disable=R0913
+                      out_prefix, style_template, args,
+                      update_meta, rewritten_input, collect):
+    if args.bibliography:
+        bib = bibdb.load(args.bibliography, _bib_cache(args))
+    else:
+        bib = None
 
     # FIXME: Use a proper data structure to keep track of cited entries
     # in a document
     if bib:
         bib.cited = set()
 
-    mbt = process(infilename=infilename,
+    parse_kwargs = dict(infilename=infilename,
+                        bibliography=bib,
+                        asides=args.asides,
+                        rewritten_input=rewritten_input,
+                        make_transclusions=partial(Transclusions,
+                                                   thumb=args.lofi))
+    stage_cache = _stage_cache(args)
+    if stage_cache:
+        parsed = cached_parse(stage_cache, _stage_key(args, infilename),
+                              **parse_kwargs)
+    else:
+        parsed = parse(**parse_kwargs)
+    mbt = process(parsed,
                   meta_schema=style_template.meta_schema,
                   bibliography=bib,
-                  asides=args.asides,
-                  update_meta=update_meta,
-                  rewritten_input=rewritten_input,
-                  make_transclusions=partial(
-                      Transclusions,
-                      thumb=args.lofi,
-                      out_dir=(tmp_dir if (args.format in ('pdf', 'png')
-                                           or args.packaging == 'zip')
-                               else None)))
-    _output_it(mbt, out_file, tmp_dir, out_prefix, style_template, args, bib)
-    _maybe_clean(not args.no_clean, tmp_dir=tmp_dir,
-                 out_file=out_file, rewritten_input=rewritten_input)
-    exit_code.exit()
+                  update_meta=update_meta)
+    profiling.count_document(mbt[1], mbt[2])
+    return _output_all(mbt, out_file, tmp_dir, out_prefix, style_template,
+                       args, bib, collect=collect)
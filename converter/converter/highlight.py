@@ -2,9 +2,10 @@ import regex as re
 
 from converter.ezmatch import Var
 
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter, LatexFormatter # pylint: disable=E0611
+
+# everything _guess_lang can come up with
+LANGS = ('python', 'ruby', 'java', 'c', 'javascript', 'css', 'html', 'latex',
+         'clojure', 'sql', 'xml', 'bash')
 
 # FIXME(alexander): this is a mere toy, obviously, but
 # good enough for testing purposes. It shouldn't be too hard
@@ -42,6 +43,10 @@ def _as(format, node):
     assert node == ('pre', {}, [PRE])
     s = PRE.val
     lang = _guess_lang(s)
+    # pygments is only imported if there's some code to highlight
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name
+    from pygments.formatters import HtmlFormatter, LatexFormatter # pylint: disable=E0611
     if format == 'html':
         formatter = HtmlFormatter()
     elif format == 'latex':
@@ -50,6 +55,13 @@ def _as(format, node):
         raise RuntimeError('Not a valid output format: %r' % format)
     return highlight(s, get_lexer_by_name(lang), formatter)
 
+def preload():
+    """Import pygments and the lexers for all `LANGS` up front."""
+    from pygments.lexers import get_lexer_by_name
+    import pygments.formatters # pylint: disable=W0612
+    for lang in LANGS:
+        get_lexer_by_name(lang)
+
 def as_html(node):
     # HACK(alexander): strip the bogus surrounding div that pygments
     # uses. A `<code>` element might make sense, but this doesn't
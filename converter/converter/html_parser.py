@@ -13,33 +13,32 @@ from collections import OrderedDict
 import logging as log
 import regex as re
 
-import cssutils
-import cssutils.css
-
-from html5lib import sanitizer
-import html5lib
 from lxml import etree
-import lxml.html
-from lxml.html.clean import Cleaner
-from lxml.html.defs import safe_attrs
-from bs4 import UnicodeDammit
 
 from converter.ezmatch import Var
 from converter.internal import COLOR_TYPES, mkcmd, mkel, ALLOWED_TAGS
 from converter.preprocess import maybe_anchorize_id
+from converter import profiling
 
 FIGURE_PROPS = ('display', 'width')
 
 ALIGNMENTS = ('left', 'center', 'right', 'justify')
 
-# FIXME(alexander): monkey patch html5lib to allow through data urls
-import lxml.html.clean
-lxml.html.clean._javascript_scheme_re = re.compile( # pylint: disable=W0212
-    r'\s*(?:javascript|jscript|livescript|vbscript|about|mocha):', re.I)
-
 EXTRA_ATTRS = {'style', 'data-value', 'data-continue-list'}
 
+# NB: html5lib, bs4, cssutils and lxml.html are slow to import and only
+# needed for some inputs, so they are imported on first use.
+
+JAVASCRIPT_SCHEME_REX = re.compile(
+    r'\s*(?:javascript|jscript|livescript|vbscript|about|mocha):', re.I)
+
 def _clean_inplace(xml):
+    import lxml.html.clean
+    from lxml.html.clean import Cleaner
+    from lxml.html.defs import safe_attrs
+    # FIXME(alexander): monkey patch html5lib to allow through data urls
+    lxml.html.clean._javascript_scheme_re = ( # pylint: disable=W0212
+        JAVASCRIPT_SCHEME_REX)
     # don't clean style attrs; they carry semantic info in some cases
     Cleaner(style=False,
             page_structure=False,
@@ -51,6 +50,8 @@ def parse_html(s):
 
     See `parse_html_frag` docstring as well.
     """
+    import lxml.html
+    from bs4 import UnicodeDammit
     # lxml.html chockes on whitespace or empty s
     s = s.strip() or '<body></body>'
     dammit = UnicodeDammit(s, is_html=True)
@@ -58,9 +59,15 @@ def parse_html(s):
     xml = lxml.html.document_fromstring(s, parser=parser)
     return _clean_inplace(xml)
 
-class Sanitizer(sanitizer.HTMLSanitizer): # pylint: disable=R0904
-    # allow data urls, disallow other cruft
-    allowed_protocols = ['http', 'https', 'ftp', 'sftp', 'urn', 'data']
+_SANITIZER = []
+def _sanitizer():
+    if not _SANITIZER:
+        from html5lib import sanitizer
+        class Sanitizer(sanitizer.HTMLSanitizer): # pylint: disable=R0904
+            # allow data urls, disallow other cruft
+            allowed_protocols = ['http', 'https', 'ftp', 'sftp', 'urn', 'data']
+        _SANITIZER.append(Sanitizer)
+    return _SANITIZER[0]
 
 def parse_html_frag(s):
     """Parse a html fragment `s` to an lxml etree.
@@ -86,10 +93,11 @@ def parse_html_frag(s):
         # I don't think we have much hope of detecting the encoding from
         # arbitrary html fragments
         log.warn("Non-unicode input given to parse_html_frag: %r", s)
+    import html5lib
     parser = html5lib.HTMLParser(
         tree=html5lib.treebuilders.getTreeBuilder("lxml"),
         namespaceHTMLElements=False,
-        tokenizer=Sanitizer)
+        tokenizer=_sanitizer())
     xml = parser.parse(s)
     return xml
 
@@ -103,6 +111,7 @@ def space_normalize(s):
 
 def color_normalize(color_string, strip_alpha=True):
     """Normalize CSS color to hex or rgba."""
+    import cssutils.css
     color = cssutils.css.ColorValue(color_string)
     if color.alpha == 1.0 or strip_alpha:
         return "#%02x%02x%02x" % (color.red, color.green, color.blue)
@@ -111,6 +120,7 @@ def color_normalize(color_string, strip_alpha=True):
                                       color.alpha)
 
 def style_normalize(tag, style):
+    import cssutils
     props = (prop for prop in cssutils.parseStyle(style)
              if prop.wellformed)
     if tag == 'figure':
@@ -312,10 +322,13 @@ def parse_to_raw_body(infilename, rewritten_input, make_transclusions):
         s = infile.read()
     finally:
         infile.close()
-    html = parse_html(s)
+    with profiling.stage('preparse'):
+        html = parse_html(s)
     lang = next(html.iter()).attrib.get('lang', None) #pylint: disable=W0612
     handle_data_url = transclusions.add_data_url
-    raw_body = parse_body(html.find('body'), handle_data_url=handle_data_url)
+    with profiling.stage('parse_body'):
+        raw_body = parse_body(html.find('body'),
+                              handle_data_url=handle_data_url)
     return raw_body, transclusions, []
 
 
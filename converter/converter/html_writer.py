@@ -2,6 +2,7 @@
 #-*- file-encoding: utf-8 -*-
 import cgi
 import copy
+from itertools import chain
 import regex as re
 from collections import OrderedDict
 
@@ -100,23 +101,37 @@ def write(out_file, style_template, bibliography, # pylint: disable=R0913,R0914
     endnotified = _endnotify_html(sectioned)
     # We prefer our HTML not to have nested sections, so we strip them out.
     unsectioned = unsectionize(endnotified)  # XXX(ash): this is not cool.
-    body_str = write_body(
-        parsed_body=prepend + unsectioned,
-        bibliography=bibliography,
-        indent='',
-        transclusions=transclusions,
-        h_shift=style_template.h_shift)
-
-    if bibliography:
-        parsed_bibliography = _append_bibliography(bibliography)
-        if parsed_bibliography:
-            body_str += write_body(parsed_bibliography)
-
-    print >> out_file, style_template.html_template(
+    def body_chunks():
+        for chunk in iter_body(
+                parsed_body=prepend + unsectioned,
+                bibliography=bibliography,
+                indent='',
+                transclusions=transclusions,
+                h_shift=style_template.h_shift):
+            yield chunk
+        # only now do we know what got cited
+        if bibliography:
+            parsed_bibliography = _append_bibliography(bibliography)
+            if parsed_bibliography:
+                for chunk in iter_body(parsed_bibliography):
+                    yield chunk
+
+    # the body is streamed into `out_file` as it's generated, rather than
+    # being built up as one string and then copied into the template
+    parts = style_template.html_template_parts(
         inline=not transclusions.out_dir,
-        body=body_str,
         lang=lang,
         title=title)
+    chunks = body_chunks()
+    if len(parts) != 2:
+        chunks = list(chunks) # needed more than once (or not at all)
+    out_file.write(parts[0])
+    for part in parts[1:]:
+        for chunk in chunks:
+            out_file.write(chunk.encode('utf-8') if isinstance(chunk, unicode)
+                           else chunk)
+        out_file.write(part)
+    out_file.write('\n')
 
 
 
@@ -151,6 +166,40 @@ def _space_kludge(s):
     # but then we'd have to look out for <script>s in <pre>s
     return "\n".join(line.rstrip() for line in s.strip().split('\n'))
 
+def _iter_space_kludge(chunks):
+    """Like ``_space_kludge(''.join(chunks))``, but yields line by line."""
+    started = False
+    blank_lines = 0
+    rest = ''
+    # the extra newline flushes the last line
+    for chunk in chain(chunks, ['\n']):
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            line = line.rstrip()
+            if not line:
+                blank_lines += 1
+            elif not started:
+                started = True
+                blank_lines = 0
+                yield line.lstrip()
+            else:
+                yield '\n' * (blank_lines + 1) + line
+                blank_lines = 0
+
+def iter_body(parsed_body, bibliography=None, # pylint: disable=R0913
+              transclusions=Transclusions({}), indent='', h_shift=0,
+              epub_clean=False):
+    """Like `write_body`, but yields the output as it's generated."""
+    return _iter_space_kludge(
+        handle_fragment(frag,
+                        indent=indent,
+                        transclusions=transclusions,
+                        h_shift=h_shift,
+                        epub_clean=epub_clean,
+                        bibliography=bibliography)
+        for frag in parsed_body)
+
 def write_body(parsed_body, bibliography=None, # pylint: disable=R0913
                transclusions=Transclusions({}), indent='', h_shift=0,
                epub_clean=False):
@@ -0,0 +1,169 @@
+#-*- file-encoding: utf-8 -*-
+r"""Running gdoc-to conversions in-process, one job at a time.
+
+A job is just a gdoc-to command line (minus the program name). Running it
+in-process saves the interpreter startup and import costs, but since the
+converter keeps a fair amount of global state (exit codes, error counters,
+logging configuration) and freely writes to stdout and stderr, each job is
+sandboxed as follows:
+
+- the global state is reset before every job;
+- all temporary files go into a fresh per-job temp dir, which is removed
+  afterwards (unless ``--no-clean`` was passed);
+- diagnostic output (logging, stderr, subprocess output) is captured and
+  returned as part of the result;
+- ``sys.exit`` calls are translated into the job's exit code.
+
+Since the output can't go to stdout, jobs must name an output file.
+"""
+from collections import OrderedDict
+import json
+import logging as log
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from signal import signal, SIGINT, SIG_IGN
+
+from . import exit_code
+from . import gdoc_converter
+
+
+class JobError(Exception):
+    pass
+
+
+def _check_args(args):
+    if args.serve or args.batch:
+        raise JobError("jobs can't start servers or batches")
+    if args.infile in ('-', sys.stdin):
+        raise JobError('jobs need an input file, not stdin')
+    if args.outfile in (None, '-'):
+        raise JobError('jobs need an output file, not stdout')
+
+
+def _run_captured(argv, diag):
+    root = log.getLogger()
+    old_handlers, old_level = root.handlers[:], root.level
+    old_stderr = sys.stderr
+    handler = log.StreamHandler(diag)
+    handler.setFormatter(log.Formatter(log.BASIC_FORMAT))
+    root.handlers[:] = [handler]
+    sys.stderr = diag
+    try:
+        args = gdoc_converter.parse_args(argv)
+        _check_args(args)
+        root.setLevel(max(log.CRITICAL - args.verbose*10, log.DEBUG))
+        gdoc_converter.convert(args)
+    except SystemExit as e:
+        return e.code or 0
+    except JobError as e:
+        log.error('Bad job %r: %s', argv, e)
+        return exit_code.USAGE_ERROR_EXIT
+    except Exception: # pylint: disable=W0703
+        log.exception('Job %r blew up', argv)
+        return exit_code.INTERNAL_ERROR_EXIT
+    finally:
+        sys.stderr = old_stderr
+        root.handlers[:] = old_handlers
+        root.setLevel(old_level)
+    return exit_code.final_exit_code
+
+
+def run_job(argv):
+    """Run gdoc-to with the command line arguments `argv`.
+
+    Returns an ordered dict with the job's `exit_code`, its `diagnostics` and
+    the `elapsed` wall-clock time in seconds.
+    """
+    tic = time.time()
+    old_tempdir = tempfile.tempdir
+    job_dir = tempfile.mkdtemp(prefix='typesetr-job')
+    tempfile.tempdir = job_dir
+    try:
+        with tempfile.TemporaryFile() as diag:
+            code = _run_captured(list(argv), diag)
+            diag.seek(0)
+            diagnostics = diag.read()
+    finally:
+        tempfile.tempdir = old_tempdir
+    if '--no-clean' not in argv:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return OrderedDict([('argv', list(argv)),
+                        ('exit_code', code),
+                        ('diagnostics', diagnostics.decode('utf-8', 'replace')),
+                        ('elapsed', round(time.time() - tic, 3))])
+
+
+def run_forked_job(argv):
+    """Like `run_job`, but run the job in a forked child process.
+
+    The child starts out as a copy-on-write clone of the current (warm)
+    process and whatever the job does to the global state dies with it.
+    """
+    tic = time.time()
+    r, w = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(r)
+        try:
+            with os.fdopen(w, 'w') as f:
+                json.dump(run_job(argv), f)
+        finally:
+            os._exit(0) # pylint: disable=W0212
+    os.close(w)
+    with os.fdopen(r) as f:
+        data = f.read()
+    _, status = os.waitpid(pid, 0)
+    try:
+        return json.loads(data, object_pairs_hook=OrderedDict)
+    except ValueError: # killed before it could report back
+        pass
+    return OrderedDict([('argv', list(argv)),
+                        ('exit_code', exit_code.INTERNAL_ERROR_EXIT),
+                        ('diagnostics', u'Job process died (status %d)\n' %
+                         status),
+                        ('elapsed', round(time.time() - tic, 3))])
+
+
+def read_manifest(manifest):
+    with open(manifest) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                argv = json.loads(line)['args']
+            except (ValueError, KeyError, TypeError):
+                raise JobError('%s:%d: malformed job %r' % (
+                    manifest, lineno, line))
+            yield map(unicode, argv)
+
+
+def run_batch(manifest, processes):
+    """Run all jobs in `manifest` across a pool of `processes` workers.
+
+    Prints one JSON result line per job, in manifest order, and returns the
+    exit codes of all jobs combined (see `exit_code.combine`).
+    """
+    try:
+        argvs = list(read_manifest(manifest))
+    except JobError as e:
+        log.fatal('%s', e)
+        return exit_code.USAGE_ERROR_EXIT
+    log.info('Running %d jobs with %d workers', len(argvs), processes)
+    # the workers are forked *after* the converter has been imported, so
+    # they start out warm
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=lambda: signal(SIGINT, SIG_IGN))
+    codes = []
+    try:
+        for result in pool.imap(run_job, argvs):
+            print json.dumps(result)
+            sys.stdout.flush()
+            codes.append(result['exit_code'])
+    finally:
+        pool.close()
+        pool.join()
+    return exit_code.combine(codes)
@@ -1,12 +1,17 @@
 #-*- file-encoding: utf-8 -*-
 from contextlib import contextmanager
 from functools import partial
+from itertools import imap
 import logging as log
+import multiprocessing
+import os
 import regex as re
+import string
 import unicodedata
 import urlparse
 
 from converter.citations import CITE_REX, EN_DASH
+from converter import docerror
 from converter.docerror import docproblem
 from converter.ezmatch import Var, Seq
 from converter.internal import mkel, H_TAGS
@@ -245,6 +250,8 @@ def latexify_href(url):
     return _href_escape(url).replace('#', '\\#').replace('%', '\\%')
 
 _NUM2ROMAN = "".join(map(chr, range(256))).replace('0123456789', 'ZABCDEFGHI')
+_ROMAN2NUM = string.maketrans('ZABCDEFGHI', '0123456789')
+_URLNAME_REX = re.compile(r'\\tystrurl([ZA-I]+)(?![A-Za-z])')
 def urldef(href, defs):
     if href.count('{') != href.count('}'):
         href = _href_escape(href)
@@ -252,6 +259,17 @@ def urldef(href, defs):
     defs.append(raw(r'\urldef{\%s}\url{%s}' % (urlname, href)))
     return cmd(urlname, [], [])
 
+def renumber_urldefs(latex, offset, count=0):
+    r"""Shift the numbers of the `urldef`\s used in `latex` by `offset`.
+
+    >>> print renumber_urldefs(r'\tystrurlA{} \tystrurlI{}', 1)
+    \tystrurlB{} \tystrurlAZ{}
+    """
+    def shift(m):
+        n = int(str(m.group(1)).translate(_ROMAN2NUM)) + offset
+        return r'\tystrurl' + str(n).translate(_NUM2ROMAN)
+    return _URLNAME_REX.sub(shift, latex, count=count)
+
 def small(text):
     return  texcmd('small', text)
 
@@ -292,6 +310,7 @@ class LatexWriter(object):
 
     def __init__(self, transclusions=None, section_corresponds_to='h1'):
         self.transclusions = transclusions
+        self.section_corresponds_to = section_corresponds_to
         self.section_offset = (SECTION_COMMANDS.index('section') -
                                H_TAGS.index(section_corresponds_to))
         assert section_corresponds_to in H_TAGS
@@ -412,9 +431,7 @@ class LatexWriter(object):
                      if n != 'lang']
         return '\n'.join(head_cmds + self.urldefs)
 
-    def maybe_add_bibliography_section(self, latex_body, bib, bib_preamble):
-        if not bib:
-            return latex_body
+    def bibliography_commands(self, bib_preamble):
         bib_cmds = []
         if bib_preamble:
             bib_cmds.append(nl(cmd('defbibnote', [],
@@ -424,7 +441,7 @@ class LatexWriter(object):
         else:
             bib_opts = []
         bib_cmds.append(cmd('printbibliography', bib_opts))
-        return join(nl(nl(latex_body)), *bib_cmds)
+        return bib_cmds
 
     def bad_command(self, head, attrs, body):
         assert head in ('LIT', 'CMD')
@@ -528,6 +545,14 @@ class LatexWriter(object):
         yield
         self.context.pop()
 
+    def iter_latexify(self, body):
+        """Like ``self.latexify(body)``, but yields the output in chunks.
+
+        That's one chunk per top-level element of `body`, so that large
+        documents aren't copied around as a whole.
+        """
+        return _fix_trailing_newlines(imap(self.latexify, body))
+
     def latexify(self, ast): # pylint: disable=E0102,R0914,R0915,R0911,R0912
         if isinstance(ast, list):
             return re.sub('\n\n$', '\n',
@@ -793,26 +818,158 @@ assert latexify_metavarname('name') == 'tystrname'
 
 
 
+# mutated from outside (gdoc-to --split-chapters, --latexify-jobs)
+SPLIT_CHAPTERS = False
+PROCESSES = 1
+CHAPTER_NAME = 'chapter-%03d'
+CHAPTER_GLOB = 'chapter-[0-9][0-9][0-9].tex'
+
+def split_sections(body):
+    """Split `body` before each of its top-level headings.
+
+    Returns the part before the first heading and the list of sections.
+
+    >>> split_sections([('p', {}, ['Intro']), ('h2', {}, ['A']), 'a',
+    ...                 ('h3', {}, ['A.1']), ('h2', {}, ['B'])])
+    ... # doctest: +NORMALIZE_WHITESPACE
+    ([('p', {}, ['Intro'])],
+     [[('h2', {}, ['A']), 'a', ('h3', {}, ['A.1'])], [('h2', {}, ['B'])]])
+    """
+    levels = [H_TAGS.index(e[0]) for e in body
+              if isinstance(e, tuple) and e[0] in H_TAGS]
+    if not levels:
+        return body, []
+    top = H_TAGS[min(levels)]
+    front, sections = [], []
+    for e in body:
+        if isinstance(e, tuple) and e[0] == top:
+            sections.append([])
+        (sections[-1] if sections else front).append(e)
+    return front, sections
+
+def _fix_trailing_newlines(chunks):
+    """Yield `chunks`, as fixed up at the end by `LatexWriter.latexify`."""
+    tail = u''
+    for chunk in chunks:
+        chunk = tail + chunk
+        # hold back enough for the trailing '\n\n$' fixup in `latexify`
+        # ('$' also matches before a final newline)
+        tail = chunk[-3:]
+        if chunk[:-3]:
+            yield chunk[:-3]
+    yield re.sub('\n\n$', '\n', tail)
+
+# set in the parent before forking the pool
+_POOL_WRITER_KWARGS = {}
+
+def _latexify_piece(body):
+    # the parent replays the log records in document order
+    root = log.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    writer = LatexWriter(**_POOL_WRITER_KWARGS)
+    error_count = docerror.ERROR_COUNT
+    with docerror.recording_log() as records:
+        latex = u''.join(imap(writer.latexify, body))
+    return (latex, writer.urldefs, bool(writer.post_float_yuck),
+            docerror.ERROR_COUNT - error_count, records)
+
+def parallel_latexify(writer, body, processes):
+    """Like ``writer.iter_latexify(body)``, but in a pool of `processes`.
+
+    Every top-level section (see `split_sections`) is latexified by a fresh
+    writer in a worker. Their urldefs are then renumbered to follow the
+    previous sections', as they would in a serial run, and the log records
+    are replayed in order. The output is identical to the serial one: the
+    sections with document problems (whose numbers, like urldefs', show up in
+    the output) or with footnotes that spill over into the next section (and
+    that next section) are redone by `writer` itself, in order.
+    """
+    front, sections = split_sections(body)
+    pieces = ([front] if front else []) + sections
+    if (processes < 2 or len(pieces) < 2 or docerror.ON_ERROR != 'log'
+            # e.g. batch workers
+            or multiprocessing.current_process().daemon):
+        return writer.iter_latexify(body)
+    global _POOL_WRITER_KWARGS # pylint: disable=W0603
+    _POOL_WRITER_KWARGS = dict(
+        transclusions=writer.transclusions,
+        section_corresponds_to=writer.section_corresponds_to)
+    pool = multiprocessing.Pool(min(processes, len(pieces)))
+    try:
+        results = pool.map(_latexify_piece, pieces, chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+    latexes = []
+    for piece, (latex, urldefs, yuck, problems, records) in zip(pieces,
+                                                               results):
+        if problems or yuck or writer.post_float_yuck:
+            log.debug('Latexifying a section again to get the problem numbers'
+                      ' and footnotes right')
+            latexes.append(u''.join(imap(writer.latexify, piece)))
+            continue
+        offset = len(writer.urldefs)
+        latexes.append(renumber_urldefs(latex, offset))
+        writer.urldefs.extend(renumber_urldefs(urldef, offset, count=1)
+                              for urldef in urldefs)
+        docerror.replay_log(records)
+    return _fix_trailing_newlines(latexes)
+
+def latexify_chapters(writer, parsed_body, out_dir):
+    r"""Like ``writer.latexify(parsed_body)``, but one file per chapter.
+
+    Every top-level section goes to a file of its own in `out_dir`, which
+    gets pulled in with ``\include``. That way the chapters have ``.aux``
+    files of their own, so that builds can be restricted to some of them
+    with ``\includeonly`` (see `latexbuild.include_only`) without breaking
+    cross-references to the others. NB: ``\include`` puts a ``\clearpage``
+    before and after every chapter, so each starts on a page of its own,
+    whatever the style does otherwise.
+    """
+    front, sections = split_sections(parsed_body)
+    includes = [writer.latexify(front)]
+    for i, section in enumerate(sections, 1):
+        name = CHAPTER_NAME % i
+        with open(os.path.join(out_dir, name + '.tex'), 'wb') as f:
+            f.write(writer.latexify(section).encode('utf-8'))
+        includes.append(nl(cmd('include', [], [name])))
+    return join(*includes)
+
 def write(out_file, style_template, bib, # pylint: disable=R0913,W0613
           meta, parsed_body, transclusions):
     head = meta.items()
     with open(style_template.latex_template) as f:
         tex_tmpl = f.read().decode('utf-8')
-        writer = LatexWriter(
-            transclusions=transclusions,
-            section_corresponds_to=style_template.section_corresponds_to,
-            )
-        bib = head.pop('bibliography', None)
-        latex_body = writer.maybe_add_bibliography_section(
-            writer.latexify(parsed_body),
-            bib=bib,
-            bib_preamble=head.pop('bibliography-preamble', None))
-        latex_head = writer.make_latex_head(head)
-        latex_meta = writer.xmp_meta(head)
-        print >> out_file, (
-            tex_tmpl.
-            replace('INTERPOLATEBABEL',
-                    BABEL_HEADER % dict(lang=head['lang'].to_babel())).
-            replace('INTERPOLATEHEAD', latex_head).
-            replace('INTERPOLATEMETA', latex_meta).
-            replace('INTERPOLATEBODY', latex_body).encode('utf-8'))
+    writer = LatexWriter(
+        transclusions=transclusions,
+        section_corresponds_to=style_template.section_corresponds_to,
+        )
+    bib = head.pop('bibliography', None)
+    bib_preamble = head.pop('bibliography-preamble', None)
+    # The body is kept as a list of top-level chunks and written out piece
+    # by piece, rather than copied into the template as one big string. It
+    # can't go to `out_file` right away, because the head needs the urldefs
+    # collected from it.
+    if SPLIT_CHAPTERS:
+        latex_body = [latexify_chapters(writer, parsed_body,
+                                        os.path.dirname(out_file.name))]
+    else:
+        latex_body = list(parallel_latexify(writer, parsed_body, PROCESSES))
+    if bib:
+        latex_body.append(u'\n\n')
+        latex_body.extend(writer.bibliography_commands(bib_preamble))
+    latex_head = writer.make_latex_head(head)
+    latex_meta = writer.xmp_meta(head)
+    parts = [part.
+             replace('INTERPOLATEBABEL',
+                     BABEL_HEADER % dict(lang=head['lang'].to_babel())).
+             replace('INTERPOLATEHEAD', latex_head).
+             replace('INTERPOLATEMETA', latex_meta)
+             for part in tex_tmpl.split('INTERPOLATEBODY')]
+    out_file.write(parts[0].encode('utf-8'))
+    for part in parts[1:]:
+        for chunk in latex_body:
+            out_file.write(chunk.encode('utf-8'))
+        out_file.write(part.encode('utf-8'))
+    out_file.write('\n')
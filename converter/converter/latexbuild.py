@@ -0,0 +1,111 @@
+#-*- file-encoding: utf-8 -*-
+r"""Persistent per-document LaTeX build directories (``--latex-build-dir``).
+
+Normally every pdf is built from scratch in a fresh temp dir, so all the
+xelatex and biber passes are repeated on every conversion. With a build root,
+each document (as identified by ``--doc-id``) and style gets a build dir of its
+own. The freshly written sources are synced into it, leaving files whose
+contents haven't changed alone, and the intermediate files (``.aux``,
+``.bbl``, ``.toc``, ``.fdb_latexmk`` ...) survive between runs, so that
+latexmk can often make do with a single pass.
+
+Build dirs are never cleaned up automatically.
+"""
+from contextlib import contextmanager
+import errno
+import fcntl
+import os
+import shutil
+
+from .diskcache import cache_key
+
+BEGIN_DOCUMENT = r'\begin{document}'
+
+
+def build_dir(root, doc_id, style):
+    path = os.path.join(root, cache_key(doc_id, style))
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on the build dir `path` (for concurrent runs)."""
+    with open(os.path.join(path, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _same_contents(a, b, bufsize=64*1024):
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        while True:
+            chunk = fa.read(bufsize)
+            if chunk != fb.read(bufsize):
+                return False
+            if not chunk:
+                return True
+
+
+def sync_tree(src, dst):
+    """Copy all files below `src` to `dst`, unless they are unchanged.
+
+    Symlinks are copied as symlinks. Returns the number of files copied.
+    """
+    copied = 0
+    for d, dirs, files in os.walk(src):
+        dirs.sort()
+        target_d = os.path.normpath(os.path.join(dst, os.path.relpath(d, src)))
+        if not os.path.isdir(target_d):
+            os.makedirs(target_d)
+        for fn in sorted(files):
+            source, target = os.path.join(d, fn), os.path.join(target_d, fn)
+            if os.path.islink(source):
+                # e.g. style includes; keep them links
+                link = os.readlink(source)
+                if os.path.islink(target) and os.readlink(target) == link:
+                    continue
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(link, target)
+            elif os.path.isfile(target) and not os.path.islink(target) and (
+                    _same_contents(source, target)):
+                continue
+            else:
+                if os.path.islink(target):
+                    os.remove(target)
+                shutil.copy2(source, target)
+            copied += 1
+    return copied
+
+
+def changed_files(src, dst, names):
+    """Those of `names` (relative to `src`) that differ from their `dst` copy."""
+    return [name for name in names
+            if not os.path.isfile(os.path.join(dst, name))
+            or not _same_contents(os.path.join(src, name),
+                                  os.path.join(dst, name))]
+
+
+def include_only(tex_filename, names):
+    r"""Restrict the build of `tex_filename` to the ``\include``\d `names`.
+
+    The ``\includeonly`` goes right before the `BEGIN_DOCUMENT`, which
+    `tex_filename` must have.
+    """
+    with open(tex_filename, 'rb') as f:
+        tex = f.read()
+    begin = tex.find(BEGIN_DOCUMENT)
+    if begin < 0:
+        raise ValueError('%s has no %s' % (tex_filename, BEGIN_DOCUMENT))
+    with open(tex_filename, 'wb') as f:
+        f.write(tex[:begin] + '\\includeonly{%s}\n' % ','.join(names) +
+                tex[begin:])
@@ -52,6 +52,8 @@ class Image(Literal):
         assert isinstance(style, OrderedDict)
         self.data, self.mimetype, self.style = data, mimetype, style
         assert type(self.data) is str
+        # memoized, because meta data gets serialized a lot (e.g. `__eq__`)
+        self._data_url = None
 
     def __repr__(self):
         return '%s%r' % (type(self).__name__,
@@ -69,15 +71,21 @@ class Image(Literal):
         style = d['style']
         return cls(data, mime, style)
 
+    def data_url(self):
+        if self._data_url is None:
+            self._data_url = transclusions.to_data_url(self.data,
+                                                       self.mimetype)
+        return self._data_url
+
     def to_string(self):
         return json.dumps(OrderedDict([
             ('style', self.style),
-            ('dataurl', transclusions.to_data_url(self.data, self.mimetype)),
+            ('dataurl', self.data_url()),
             ]), sort_keys=False)
 
     def get_size(self):
         from cStringIO import StringIO
-        import PIL
+        import PIL.Image
         return PIL.Image.open(StringIO(self.data)).size
 
 
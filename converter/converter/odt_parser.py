@@ -41,6 +41,7 @@ from converter.postprocess import blank, tidy, whack, plaintextify, postprocess
 from converter.xmltools import etree2s, to_etree
 from converter import odt_writer
 from converter import preprocess
+from converter import profiling
 
 
 # Put some upper bound on how many xml elements the meta-data section can have
@@ -130,12 +131,15 @@ def preparse(path, make_transclusions=None, rewrite=False):
             None if not rewrite else _make_rewrite_odt(z, to_parse))
 
 def parse_to_raw_body(infilename, rewritten_input, make_transclusions):
-    styles, content, transclusions, rewrite_input = preparse(
-        infilename, make_transclusions=make_transclusions,
-        rewrite=bool(rewritten_input))
-    stys = read_in_styles(styles, content, transclusions)
-    raw_body, transclusions, text = parse_styles_and_body(
-        stys, content, transclusions)
+    with profiling.stage('preparse'):
+        styles, content, transclusions, rewrite_input = preparse(
+            infilename, make_transclusions=make_transclusions,
+            rewrite=bool(rewritten_input))
+    with profiling.stage('read_in_styles'):
+        stys = read_in_styles(styles, content, transclusions)
+    with profiling.stage('parse_body'):
+        raw_body, transclusions, text = parse_styles_and_body(
+            stys, content, transclusions)
     rewrite_info = (rewrite_input, rewritten_input, text, stys, content, styles)
     return raw_body, transclusions, rewrite_info
 
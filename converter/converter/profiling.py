@@ -0,0 +1,97 @@
+#-*- file-encoding: utf-8 -*-
+r"""Per-stage timing and memory instrumentation (``gdoc-to --profile-json``).
+
+Stages are recorded with the `stage` context manager::
+
+    with profiling.stage('postprocess'):
+        ...
+
+For every stage name, we keep the accumulated wall-clock and CPU time (of
+this process and, separately, of its waited-for subprocesses like latexmk)
+and the peak resident set size seen at the end of the stage. Stages that run
+several times (e.g. one writer per output format) accumulate and count their
+`calls`. Additionally, arbitrary `counts` can be recorded.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import resource
+import time
+
+_STAGES = OrderedDict()
+_COUNTS = OrderedDict()
+_START = [time.time()]
+
+
+def reset():
+    _STAGES.clear()
+    _COUNTS.clear()
+    _START[0] = time.time()
+
+
+def _cpu(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def stage(name):
+    wall = time.time()
+    cpu = _cpu(resource.RUSAGE_SELF)
+    children_cpu = _cpu(resource.RUSAGE_CHILDREN)
+    try:
+        yield
+    finally:
+        rec = _STAGES.setdefault(name, OrderedDict([
+            ('calls', 0), ('wall', 0.), ('cpu', 0.), ('children_cpu', 0.),
+            ('peak_rss_kb', 0), ('children_peak_rss_kb', 0)]))
+        rec['calls'] += 1
+        rec['wall'] += time.time() - wall
+        rec['cpu'] += _cpu(resource.RUSAGE_SELF) - cpu
+        rec['children_cpu'] += _cpu(resource.RUSAGE_CHILDREN) - children_cpu
+        # NB: these are high-water marks for the whole process (tree) so far
+        rec['peak_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        rec['children_peak_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+def count(name, n):
+    _COUNTS[name] = _COUNTS.get(name, 0) + n
+
+
+def _elements(body):
+    for x in body:
+        if isinstance(x, tuple) and len(x) == 3 and isinstance(x[2], list):
+            yield x
+            for e in _elements(x[2]):
+                yield e
+
+
+def count_document(body, transclusions):
+    """Record the number of body elements, images and footnotes."""
+    elements = footnotes = 0
+    for e in _elements(body):
+        elements += 1
+        footnotes += e[0] == '.footnote'
+    count('body_elements', elements)
+    count('footnotes', footnotes)
+    count('images', len(transclusions.images()))
+
+
+def stages():
+    return _STAGES
+
+
+def report(**extra):
+    ans = OrderedDict(extra)
+    ans['total_wall'] = time.time() - _START[0]
+    ans['stages'] = _STAGES
+    ans['counts'] = _COUNTS
+    return ans
+
+
+def dump(filename, **extra):
+    with open(filename, 'w') as f:
+        json.dump(report(**extra), f, indent=2)
+        f.write('\n')
@@ -0,0 +1,136 @@
+#-*- file-encoding: utf-8 -*-
+r"""Scheduling of LaTeX builds: concurrency cap, time and memory limits.
+
+Any number of gdoc-to processes (batches, servers, plain command line runs)
+share a fixed number of build slots, which are lock files in a common lock
+dir: a build first has to get an exclusive `flock` on one of them, and waits
+(in the ``latex_queue`` profiling stage) until one is free. The lock goes away
+with the process holding it, so crashed runs can't leak slots.
+
+Builds run in a process group of their own, so that on timeout the whole
+latexmk/xelatex/biber tree can be killed; `kill_running` does that as well
+(gdoc-to calls it from its ``kill_children`` signal handler).
+"""
+from contextlib import contextmanager
+import errno
+import fcntl
+import logging as log
+import multiprocessing
+import os
+import resource
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from . import profiling
+
+# NB: evaluated on import, i.e. before `jobs` redirects the tempdir per job
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'typesetr-latex')
+
+# mutated from outside (gdoc-to options)
+SLOTS = multiprocessing.cpu_count()
+LOCK_DIR = DEFAULT_LOCK_DIR
+TIMEOUT = None
+MEMORY_MB = None
+
+_RUNNING = set()
+
+
+class BuildTimeout(Exception):
+    pass
+
+
+def _try_lock(path):
+    f = open(path, 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        f.close()
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return None
+    return f
+
+
+def build(cmd, **kwargs):
+    """Run the build command `cmd` in a slot, with the configured limits."""
+    with slot(SLOTS, LOCK_DIR):
+        with profiling.stage('make_pdf'):
+            run(cmd, timeout=TIMEOUT, memory_mb=MEMORY_MB, **kwargs)
+
+
+@contextmanager
+def slot(slots, lock_dir, poll_interval=0.05):
+    """Wait for one of `slots` build slots shared via `lock_dir`."""
+    try:
+        os.makedirs(lock_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    tic = time.time()
+    with profiling.stage('latex_queue'):
+        while True:
+            for i in range(slots):
+                lock = _try_lock(os.path.join(lock_dir, 'slot-%d' % i))
+                if lock:
+                    break
+            else:
+                time.sleep(poll_interval)
+                continue
+            break
+    waited = time.time() - tic
+    if waited > 1:
+        log.info('Waited %.1fs for a latex build slot', waited)
+    profiling.count('latex_queue_wait_ms', int(1000 * waited))
+    try:
+        yield
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+
+def run(cmd, timeout=None, memory_mb=None, **kwargs):
+    """Like `subprocess.check_call`, but with limits for the whole build.
+
+    The build is killed after `timeout` seconds (raising `BuildTimeout`), and
+    every process in it is limited to `memory_mb` of address space.
+    """
+    def set_limits():
+        os.setpgid(0, 0)
+        if memory_mb:
+            limit = memory_mb * 2**20
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    proc = subprocess.Popen(cmd, preexec_fn=set_limits, **kwargs)
+    _RUNNING.add(proc.pid)
+    timed_out = []
+    def kill():
+        timed_out.append(True)
+        _killpg(proc.pid)
+    timer = threading.Timer(timeout, kill) if timeout else None
+    try:
+        if timer:
+            timer.start()
+        ret = proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        _RUNNING.discard(proc.pid)
+    if timed_out:
+        raise BuildTimeout('%s took longer than %ds' % (cmd[0], timeout))
+    if ret:
+        raise subprocess.CalledProcessError(ret, cmd)
+
+
+def _killpg(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def kill_running():
+    for pgid in list(_RUNNING):
+        _killpg(pgid)
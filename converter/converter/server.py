@@ -0,0 +1,154 @@
+#-*- file-encoding: utf-8 -*-
+r"""A long-lived gdoc-to conversion server (``gdoc-to --serve SOCKET``).
+
+Avoids paying the interpreter startup, import and style loading costs for
+every conversion. The protocol is line based JSON over a unix domain socket:
+each request line is an object of the form::
+
+    {"args": ["-f", "pdf", "in.odt", "out.pdf"]}
+
+(i.e. the same arguments gdoc-to accepts on the command line) and is answered
+by a single line with the job result (see `jobs.run_job`)::
+
+    {"argv": [...], "exit_code": 0, "diagnostics": "...", "elapsed": 0.7}
+
+Several requests can be sent over the same connection. Jobs are run one after
+the other, because the converter relies on global state.
+
+With ``--serve SOCKET --fork`` the server instead imports all converter
+modules and preloads every style, the pygments lexers and the LaTeX include
+lists up front (`warm_up`), and then forks a process per connection, which in
+turn forks a child per job (`jobs.run_forked_job`). Every job thus starts out
+as a copy-on-write clone of the same warm process, and up to ``--jobs``
+connections are served concurrently. Each connection runs in its own process
+group, so that gdoc-to's ``kill_children`` handler, when triggered in a job,
+only takes down that connection's processes; when triggered in the server, all
+connections are killed as well.
+"""
+import errno
+from functools import partial
+import importlib
+import json
+import logging as log
+import os
+import pkgutil
+import signal
+import SocketServer
+import sys
+
+import converter
+from . import gdoc_converter
+from . import highlight
+from . import jobs
+from . import stytempl
+
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                argv = request['args']
+                assert isinstance(argv, list)
+            except (ValueError, KeyError, TypeError, AssertionError):
+                result = {'error': 'Malformed request: %r' % line}
+            else:
+                log.info('Running job %r', argv)
+                result = self.server.run_job(map(unicode, argv))
+                log.info('Job finished with exit code %d in %.2fs',
+                         result['exit_code'], result['elapsed'])
+            self.wfile.write(json.dumps(result) + '\n')
+            self.wfile.flush()
+
+
+class JobServer(SocketServer.UnixStreamServer):
+    run_job = staticmethod(jobs.run_job)
+
+
+KILL_SIGNALS = (signal.SIGABRT, signal.SIGINT, signal.SIGTERM)
+
+class ForkingJobServer(SocketServer.ForkingMixIn, JobServer):
+    run_job = staticmethod(jobs.run_forked_job)
+
+    def __init__(self, socket_path, handler, max_children):
+        JobServer.__init__(self, socket_path, handler)
+        self.max_children = max_children
+
+    def finish_request(self, request, client_address):
+        # we're in the freshly forked connection process
+        os.setpgid(0, 0)
+        self.active_children = None
+        JobServer.finish_request(self, request, client_address)
+
+    def serve_forever(self, poll_interval=0.5):
+        old_handlers = dict((sig, signal.getsignal(sig))
+                            for sig in KILL_SIGNALS)
+        def kill_connections(signum, frame):
+            for pid in self.active_children or ():
+                try:
+                    os.killpg(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            old = old_handlers[signum]
+            if callable(old):
+                old(signum, frame)
+            elif old == signal.SIG_DFL:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+        for sig in KILL_SIGNALS:
+            signal.signal(sig, kill_connections)
+        try:
+            JobServer.serve_forever(self, poll_interval)
+        finally:
+            for sig, handler in old_handlers.iteritems():
+                signal.signal(sig, handler)
+
+
+def warm_up(style_base):
+    """Do the work that all jobs share once, before forking."""
+    for _, name, _ in pkgutil.iter_modules(converter.__path__):
+        try:
+            importlib.import_module('converter.' + name)
+        except ImportError as e:
+            log.warn('Not preloading converter.%s: %s', name, e)
+    highlight.preload()
+    for style in stytempl.available_styles(style_base):
+        style_path = os.path.join(style_base, style)
+        if not os.path.exists(os.path.join(style_path, 'metadata.yml')):
+            continue
+        template = gdoc_converter.load_style_template(
+            style_base, stytempl.ensure_style_exists(style_base, style), {})
+        template.latex_includes()
+        for format in ('tex', 'html', 'epub'): # pylint: disable=W0622
+            if template.supports_format(format):
+                template.includes_for(format)
+    log.info('Preloaded %d modules and %d styles',
+             sum(1 for m in sys.modules if m.startswith('converter.')),
+             len(gdoc_converter._STYLE_TEMPLATES)) # pylint: disable=W0212
+
+
+def _remove_stale_socket(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def serve(socket_path, server_class=JobServer):
+    _remove_stale_socket(socket_path)
+    server = server_class(socket_path, JobHandler)
+    os.chmod(socket_path, 0600)
+    log.warn('Serving conversion jobs on %s', socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _remove_stale_socket(socket_path)
+
+
+def serve_forked(socket_path, style_base, max_children):
+    warm_up(style_base)
+    serve(socket_path, partial(ForkingJobServer, max_children=max_children))
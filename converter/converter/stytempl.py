@@ -2,7 +2,7 @@
 #-*- file-encoding: utf-8 -*-
 r"""This module encapsulates a style/ directory entry.
 """
-from distutils.dir_util import copy_tree # pylint: disable=E0611,F0401
+import copy
 import glob
 import logging as log
 import os
@@ -11,6 +11,7 @@ import sys
 
 import regex as re
 
+from .digest import hexdigest
 from . import exit_code
 from . import orderedyaml as yaml # pylint: disable=E0611
 from . import metainfo
@@ -23,6 +24,8 @@ class StyleTemplate(object): # pylint: disable=R0902
 
         self._output_format_supported = {}
         self._already_warned_about = set()
+        self._digests = {}
+        self._includes = {}
 
         if style_name[0] in ('.', '/'):
             self.style_path = style_name
@@ -45,7 +48,26 @@ class StyleTemplate(object): # pylint: disable=R0902
         # meta info
         meta_file = os.path.join(self.style_path, 'metadata.yml')
         with open(meta_file) as f:
-            self.meta_schema = metainfo.MetaSchema(yaml.load(f), self.gdoc_meta)
+            self._metadata = yaml.load(f)
+        self.meta_schema = metainfo.MetaSchema(self._metadata, self.gdoc_meta)
+        self._loaded_signature = self._signature()
+
+    def for_document(self, gdoc_meta):
+        """A copy of this template for a document with `gdoc_meta`.
+
+        The copy shares the style file caches, but has its own meta schema and
+        warns about unsupported formats afresh.
+        """
+        doc_template = copy.copy(self)
+        doc_template.gdoc_meta = gdoc_meta
+        doc_template.meta_schema = metainfo.MetaSchema(self._metadata,
+                                                       gdoc_meta)
+        doc_template._already_warned_about = set() # pylint: disable=W0212
+        return doc_template
+
+    def changed_on_disk(self):
+        """Whether style files were added, removed or changed since loading."""
+        return self._signature() != self._loaded_signature
 
     @staticmethod
     def format_subdir(format):
@@ -71,32 +93,75 @@ class StyleTemplate(object): # pylint: disable=R0902
                 os.path.join(self.style_path, self.format_subdir(format)))
         return self._output_format_supported[format]
 
-    def copy_latex_includes(self, target):
-        # Copy all shared and style-specific includes to an 'includes' dir
-        # within the target dir.
+    def latex_includes(self):
+        """Map include paths to files; style includes override shared ones."""
+        if 'latex' not in self._includes:
+            ans = _files_below(os.path.join(
+                self.base_path, 'shared', 'latex', 'include'))
+            ans.update(_files_below(self.latex_path))
+            self._includes['latex'] = ans
+        return self._includes['latex']
+
+    def link_latex_includes(self, target):
+        # Symlink all shared and style-specific includes into an 'include'
+        # dir within the target dir; copying them for every job is too slow.
         target_dir = os.path.join(target, 'include')
-        shared_includes = os.path.join(
-            self.base_path, 'shared', 'latex', 'include')
-        copy_tree(shared_includes, target_dir)
-        if os.path.isdir(self.latex_path):
-            copy_tree(self.latex_path, target_dir)
+        for rel_path, path in self.latex_includes().iteritems():
+            dest = os.path.join(target_dir, rel_path)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            os.symlink(os.path.abspath(path), dest)
+
+    def _signature(self):
+        signature = []
+        for top in (self.style_path, os.path.join(self.base_path, 'shared')):
+            for d, dirs, files in os.walk(top):
+                if os.path.basename(d) == 'latex' and 'format' in dirs:
+                    # precompiled formats (see texformat) are built from the
+                    # style files, they aren't part of the style
+                    dirs.remove('format')
+                dirs.sort()
+                files.sort()
+                for fn in files:
+                    path = os.path.join(d, fn)
+                    st = os.stat(path)
+                    signature.append((path, st.st_size, st.st_mtime))
+        return tuple(signature)
+
+    def hexdigest(self):
+        """A digest of the contents of all style files, shared ones included.
+
+        Only re-reads the files if their sizes or mtimes have changed since
+        the last call.
+        """
+        signature = self._signature()
+        if signature not in self._digests:
+            parts = []
+            for path, _, _ in signature:
+                with open(path, 'rb') as f:
+                    parts.append('%s:%s' % (
+                        os.path.relpath(path, self.base_path),
+                        hexdigest(f.read())))
+            # NB: shared with the `for_document` copies, so mutate in place
+            self._digests.clear()
+            self._digests[signature] = hexdigest('\n'.join(parts))
+        return self._digests[signature]
 
     def includes_for(self, format):
         # NB! this needs to be tightened up if the style templates
         # are not trusted to prevent reading random FS content
-        ans = {}
-        include_dir = os.path.join(self.format_dir(format), "include")
-        for d, dirs, files in os.walk(include_dir):
-            dirs.sort()
-            files.sort()
-            rel_d = os.path.relpath(d, include_dir)
-            for fn in files:
-                ans[os.path.join(rel_d, fn)] = os.path.join(d, fn)
-        return ans
+        if format not in self._includes:
+            self._includes[format] = _files_below(
+                os.path.join(self.format_dir(format), "include"))
+        return dict(self._includes[format])
 
     def html_template(self, inline, title, lang, body):
         if isinstance(body, unicode):
             body = body.encode('utf-8')
+        return body.join(self.html_template_parts(inline, title, lang))
+
+    def html_template_parts(self, inline, title, lang):
+        """The filled in html template, split where the body goes."""
         if isinstance(title, unicode):
             title = title.encode('utf-8')
         from converter.html_writer import write_body
@@ -122,11 +187,21 @@ class StyleTemplate(object): # pylint: disable=R0902
         html_head = indent + write_body(head_parts, indent=indent)
         with open(os.path.join(self.format_dir('html'),
                                'template', 'template.html')) as f:
-            return (f.read() % dict(title=title,
-                                    lang=lang,
-                                    body=body,
-                                    head=html_head,
-                                   ))
+            return [part % dict(title=title,
+                                lang=lang,
+                                head=html_head,
+                               )
+                    for part in f.read().split('%(body)s')]
+
+def _files_below(include_dir):
+    ans = {}
+    for d, dirs, files in os.walk(include_dir):
+        dirs.sort()
+        files.sort()
+        rel_d = os.path.relpath(d, include_dir)
+        for fn in files:
+            ans[os.path.join(rel_d, fn)] = os.path.join(d, fn)
+    return ans
 
 def available_styles(base):
     return [style
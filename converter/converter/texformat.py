@@ -0,0 +1,154 @@
+#-*- file-encoding: utf-8 -*-
+r"""Precompiled LaTeX preamble formats, to speed up pdf builds.
+
+For small documents most of xelatex's time goes into loading the preamble
+(typesetr.sty, hyperref, fontspec, babel...). The part of a style's LaTeX
+template up to ``\csname endofdump\endcsname`` only depends on the style and
+the document's language, so it can be dumped once into a format file with
+mylatexformat::
+
+    python -m converter.texformat --style-base styles typesetr/Foo -l en de
+
+XeTeX can't dump the (OpenType) fonts fontspec loads, though, so while
+dumping ``\tystrdumping`` is defined, which keeps typesetr.sty from loading
+fontspec; templates load it right after the marker instead.
+
+Formats are kept in ``format/`` in the style's latex dir (or in the shared
+fallback latex dir, for styles without one of their own) together with a
+digest of the preamble and include files they were made from and of the
+xelatex version that made them. `provide` only hands out a format whose digest
+still matches; ``makepdf`` uses it if it's there and builds the normal way
+otherwise. The ``format/`` dirs don't count towards the style's digest.
+"""
+import argparse
+import logging as log
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from .digest import hexdigest
+from .lang import Lang, ISO_TO_BABEL
+from . import stytempl
+
+DUMP_MARKER = r'\csname endofdump\endcsname'
+# what makepdf looks for
+FORMAT_NAME = 'typesetr'
+FORMAT_FILE = FORMAT_NAME + '.fmt'
+
+
+def preamble(style_template, babel):
+    """The static part of the template for `babel`, or None."""
+    from .latex_writer import BABEL_HEADER
+    with open(style_template.latex_template) as f:
+        tex_tmpl = f.read().decode('utf-8')
+    if DUMP_MARKER not in tex_tmpl:
+        return None
+    return tex_tmpl.split(DUMP_MARKER, 1)[0].replace(
+        'INTERPOLATEBABEL', BABEL_HEADER % dict(lang=babel))
+
+
+_ENGINE_VERSION = None
+def engine_version():
+    """The first line of ``xelatex --version``; formats only load in it."""
+    global _ENGINE_VERSION # pylint: disable=W0603
+    if _ENGINE_VERSION is None:
+        _ENGINE_VERSION = subprocess.check_output(
+            ['xelatex', '--version']).splitlines()[0]
+    return _ENGINE_VERSION
+
+
+def preamble_digest(style_template, babel):
+    text = preamble(style_template, babel)
+    if text is None:
+        return None
+    parts = [engine_version(), hexdigest(text.encode('utf-8'))]
+    for rel_path, path in sorted(style_template.latex_includes().iteritems()):
+        with open(path, 'rb') as f:
+            parts.append('%s:%s' % (rel_path, hexdigest(f.read())))
+    return hexdigest('\n'.join(parts))
+
+
+def format_path(style_template, babel):
+    return os.path.join(style_template.format_dir('tex'), 'format',
+                        babel + '.fmt')
+
+
+def dump(style_template, babel):
+    """Dump the format for `babel`; returns its path (None if unsupported)."""
+    text = preamble(style_template, babel)
+    if text is None:
+        log.warn('%s has no %s; not dumping a format',
+                 style_template.latex_template, DUMP_MARKER)
+        return None
+    work_dir = tempfile.mkdtemp(prefix='typesetr-fmt')
+    try:
+        style_template.link_latex_includes(work_dir)
+        with open(os.path.join(work_dir, babel + '.tex'), 'wb') as f:
+            f.write(('\\def\\tystrdumping{}\n' + text + DUMP_MARKER +
+                     '\n\\begin{document}\n\\end{document}\n').encode('utf-8'))
+        env = dict(os.environ, TEXINPUTS='.:include:', BSTINPUTS='include:')
+        subprocess.check_call(['xelatex', '-ini', '-interaction=nonstopmode',
+                               '-jobname=' + babel, '&xelatex',
+                               'mylatexformat.ltx', babel + '.tex'],
+                              cwd=work_dir, env=env, stdout=sys.stderr)
+        path = format_path(style_template, babel)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.move(os.path.join(work_dir, babel + '.fmt'), path)
+        with open(path + '.digest', 'w') as f:
+            f.write(preamble_digest(style_template, babel))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return path
+
+
+def provide(style_template, babel, target_dir):
+    """Link a matching format for `babel` into `target_dir`, if there is one.
+
+    Returns whether it did.
+    """
+    path = format_path(style_template, babel)
+    if not os.path.exists(path):
+        return False
+    with open(path + '.digest') as f:
+        if f.read() != preamble_digest(style_template, babel):
+            log.info('Not using outdated format %s', path)
+            return False
+    os.symlink(os.path.abspath(path),
+               os.path.join(target_dir, FORMAT_FILE))
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Dump precompiled LaTeX preambles for styles')
+    arg = parser.add_argument
+    arg('styles', nargs='*',
+        help='The styles to dump formats for (default: all)')
+    arg('--style-base', default='/opt/typesetr/styles',
+        help='where to find the styles')
+    arg('--lang', '-l', nargs='+', default=['en'],
+        help=("The languages (iso639 codes) to dump formats for, or 'all'"
+              " (default: en)"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log.basicConfig(level=log.INFO)
+    codes = sorted(ISO_TO_BABEL) if args.lang == ['all'] else args.lang
+    babels = sorted(set(Lang(code).to_babel() for code in codes))
+    for style in args.styles or stytempl.available_styles(args.style_base):
+        style_template = stytempl.StyleTemplate(
+            args.style_base, stytempl.ensure_style_exists(args.style_base,
+                                                          style),
+            gdoc_meta={})
+        for babel in babels:
+            path = dump(style_template, babel)
+            if path:
+                log.info('Dumped %s', path)
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,22 @@
 #-*- file-encoding: utf-8 -*-
 """Module for representing images and other transclusions in odt files."""
+import base64
+from collections import OrderedDict
 import logging as log
+import math
+from multiprocessing.pool import ThreadPool
 import os.path
 import cStringIO
 
-import PIL.Image
-
 from converter.digest import hexdigest
+from converter.diskcache import cache_key
 from converter.mimetype import extension
+from converter.utils import parse_percentage
 
 def to_data_url(data, mimetype):
-    return 'data:%s;base64,%s' % (mimetype,
-                                  data.encode('base64').replace('\n', ''))
+    # NB: b64encode, unlike .encode('base64'), doesn't insert newlines that
+    # we'd have to strip out again
+    return 'data:%s;base64,%s' % (mimetype, base64.b64encode(data))
 
 def is_data_url(href):
     return href.startswith('data:')
@@ -28,8 +33,82 @@ def href_for_data(data, mimetype):
     return new_href
 
 
+# upper bound for the data urls a `Transclusions` keeps around
+DATA_URL_CACHE_BYTES = 64 * 2**20
 THUMB_PIX = 64
 THUMB_QUALITY = 80
+PRINT_QUALITY = 90
+# Rough upper bounds for how large LaTeX will print figures, in cm and as
+# fractions of that. The document's own text width (where we know it) may
+# well be smaller than the style's.
+TEXTWIDTH_CM = 17.
+FULLWIDTH_RATIO = 1.5
+MARGIN_RATIO = .5
+
+def print_widths_cm(body, textwidth_cm=None):
+    """Map the src of every figure in `body` to its largest printed width.
+
+    Images that are also used outside of figures are left out, since there's
+    no telling how large they'll get.
+    """
+    textwidth_cm = max(textwidth_cm or 0, TEXTWIDTH_CM)
+    widths = {}
+    unknown = set()
+    todo = list(body)
+    while todo:
+        e = todo.pop()
+        if isinstance(e, basestring):
+            continue
+        tag, attrs, children = e
+        if tag == 'figure':
+            style = attrs.get('style', {})
+            if style.get('display') == 'inline': # margin figure
+                ratio = MARGIN_RATIO
+            elif 'fullwidth' in attrs.get('class', []):
+                ratio = FULLWIDTH_RATIO
+            else:
+                ratio = parse_percentage(style.get('width', '100%')) / 100
+            for child in children:
+                if child[0] == 'img':
+                    widths[child[1]['src']] = max(
+                        widths.get(child[1]['src'], 0), ratio * textwidth_cm)
+                else:
+                    todo.append(child)
+        else:
+            if tag == 'img':
+                unknown.add(attrs.get('src'))
+            todo.extend(children)
+    return {src: w for (src, w) in widths.iteritems() if src not in unknown}
+
+def resample_for_print(data, width_cm, dpi):
+    """Scale image `data` down to `dpi` at `width_cm`.
+
+    Returns the new image data, or None if `data` is fine as is. Only jpegs
+    and pngs are resampled; e.g. gifs may be animated.
+    """
+    import PIL.Image
+    im = PIL.Image.open(cStringIO.StringIO(data))
+    width_px = int(math.ceil(width_cm / 2.54 * dpi))
+    filetype = im.format.lower()
+    if im.size[0] <= width_px or filetype not in ('jpeg', 'png'):
+        return None
+    height_px = max(1, int(round(1. * im.size[1] * width_px / im.size[0])))
+    if im.mode in ('1', 'P'):
+        # palettes and bitmaps don't interpolate
+        im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+    try:
+        im = im.resize((width_px, height_px), PIL.Image.ANTIALIAS)
+        if filetype == 'jpeg' and im.mode not in ('L', 'RGB', 'CMYK'):
+            # no alpha channels or palettes in jpegs
+            im = im.convert('L' if im.mode == 'LA' else 'RGB')
+        output = cStringIO.StringIO()
+        im.save(output, filetype, quality=PRINT_QUALITY, dpi=(dpi, dpi))
+    except (IOError, ValueError) as e:
+        log.warn('Not resampling %s image (%s): %s', filetype, im.mode, e)
+        return None
+    ans = output.getvalue()
+    return ans if len(ans) < len(data) else None
+
 class Transclusions(object):
     """All the embedded objects (right now, that's images) in a document.
 
@@ -55,10 +134,17 @@ class Transclusions(object):
         self._transclusions = {}
         self._mimetypes = {}
         self._sizes = {}
+        self._data_urls = OrderedDict()
+        self._data_url_bytes = 0
         for name in includes_dict:
             raw_data = includes_dict[name].read()
             self.add_raw_data(name, raw_data)
 
+    def __getstate__(self):
+        # the data urls are just a cache
+        return dict(self.__dict__, _data_urls=OrderedDict(),
+                    _data_url_bytes=0)
+
     def _add(self, data, mimetype, original_href=None):
         new_href = href_for_data(data, mimetype)
         if new_href in self._transclusions:
@@ -80,6 +166,7 @@ class Transclusions(object):
         return self._original_href_to_new[self.add_raw_data(None, img.data)]
 
     def add_raw_data(self, name_or_prefix, raw_data):
+        import PIL.Image
         im = PIL.Image.open(cStringIO.StringIO(raw_data))
         size = im.size
         output = cStringIO.StringIO()
@@ -115,9 +202,25 @@ class Transclusions(object):
     def known_transclusion_to_data_url(self, href):
         """Transform (only) `href`s to embeded objects to data urls."""
         if href in self._transclusions:
-            return to_data_url(self.get_data(href), self.get_mimetype(href))
+            return self._data_url(href)
         return href
 
+    def _data_url(self, href):
+        """Memoized `to_data_url` for `href`.
+
+        Figures and logos can be referenced many times over, so the most
+        recently used data urls are kept, up to `DATA_URL_CACHE_BYTES`.
+        """
+        url = self._data_urls.pop(href, None)
+        if url is None:
+            url = to_data_url(self.get_data(href), self.get_mimetype(href))
+            self._data_url_bytes += len(url)
+        self._data_urls[href] = url
+        while self._data_url_bytes > DATA_URL_CACHE_BYTES:
+            _, evicted = self._data_urls.popitem(last=False)
+            self._data_url_bytes -= len(evicted)
+        return url
+
     def handle_href(self, href, never_embed=False):
         new_href = (href if self.out_dir or never_embed
                     else self.known_transclusion_to_data_url(href))
@@ -132,26 +235,64 @@ class Transclusions(object):
     def get_size(self, href):
         return self._sizes[href]
 
-    def extract(self, out_dir):
+    def extract(self, out_dir, replacements=None):
         """Write all embedded objects to `out_dir`.
 
         The filename extensions will be derived
 
+        `replacements` maps hrefs to data to write instead of the original.
         """
         log.info('WRITING EMBEDDED_OBJECTS')
+        replacements = replacements or {}
         for name in self._transclusions:
             assert not name[:1] in ['.', '/', '\\']
             dirname = os.path.join(out_dir, os.path.dirname(name))
             if not os.path.exists(dirname):
                 os.mkdir(dirname)
-            data = self._transclusions[name]
+            data = replacements.get(name, self._transclusions[name])
             outpath = os.path.join(out_dir, name)
             with open(outpath, 'wb') as f:
                 f.write(data)
 
-    def provide(self):
+    def for_print(self, widths_cm, dpi, cache=None, processes=None):
+        """Images scaled down to `dpi` at their printed size, by href.
+
+        `widths_cm` is as returned by `print_widths_cm`; images that are
+        small enough already are left out. Results are kept in the
+        `DiskCache` `cache`, if given.
+        """
+        def resample(href):
+            # hrefs are content hashes
+            key = cache_key(href, '%.2f' % widths_cm[href], dpi)
+            cached = cache.get(key) if cache else None
+            if cached:
+                return href, cached['image']
+            data = resample_for_print(self._transclusions[href],
+                                      widths_cm[href], dpi)
+            if data and cache:
+                cache.put(key, {'image': data})
+            return href, data
+        hrefs = sorted(href for href in widths_cm
+                       if href in self._transclusions
+                       and self._mimetypes[href].startswith('image/'))
+        if not hrefs:
+            return {}
+        pool = ThreadPool(processes)
+        try:
+            return {href: data for (href, data) in pool.map(resample, hrefs)
+                    if data}
+        finally:
+            pool.close()
+
+    def provide(self, widths_cm=None, dpi=None, cache=None):
+        """Extract everything to `out_dir`, if set.
+
+        With `dpi`, images are scaled down for print first (see `for_print`).
+        """
         if self.out_dir:
-            self.extract(self.out_dir)
+            self.extract(self.out_dir,
+                         self.for_print(widths_cm, dpi, cache) if dpi
+                         else None)
 
     def images(self):
         return {t: d for (t, d) in self._transclusions.iteritems()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""USAGE: %prog [--reps N] [--warmup N] [-o OUT.json] [--compare BASE.json]
+                [FILES...]
+
+Benchmark the converter, stage by stage.
+
+Conversions are run in-process (see `converter.jobs`), so interpreter startup
+and import costs are excluded. Every file is converted ``--warmup`` times
+without timing and then ``--reps`` times with ``--profile-json``. For each
+stage (preparse, parse_body, postprocess, writer.tex, ...) the report gives
+the median, min and max wall and CPU time in milliseconds and the peak RSS.
+
+With ``--scale PARAM=N,...`` synthetic documents (see ``synthetic.py``) of
+increasing size are benchmarked instead, and a table of time and memory
+against size is printed for each stage.
+
+With ``--compare`` the results are checked against an earlier report; stages
+whose median got slower by more than ``--threshold`` percent (and more than
+``--min-ms`` milliseconds, to filter out noise) are flagged as regressions
+and the exit status is 1.
+"""
+
+# pylint: disable=C0103,C0111
+
+import argparse
+from collections import OrderedDict
+from functools import partial
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from converter import exit_code
+from converter import jobs
+
+import synthetic
+
+test_root = partial(os.path.join, os.path.dirname(os.path.realpath(__file__)))
+typesetr_root = partial(test_root, '..', '..')
+
+FIXTURES = [test_root('benchmark_files', 'small.odt'),
+            test_root('benchmark_files', 'normal.odt'),
+            test_root('benchmark_files', 'large.odt'),
+            test_root('data', 'comprehensive-test-from-odt.docx'),
+            test_root('data', 'comprehensive-test.odt.html'),
+            test_root('benchmark_files', 'normal.md')]
+
+
+def median(xs):
+    """The median of `xs`; also used by the other benchmark scripts."""
+    xs = sorted(xs)
+    n = len(xs)
+    return xs[n//2] if n % 2 else (xs[n//2 - 1] + xs[n//2]) / 2.
+
+
+def profile_once(filename, opts, work_dir):
+    """Convert `filename` once and return the --profile-json report."""
+    profile = os.path.join(work_dir, 'profile.json')
+    out_prefix = os.path.join(work_dir, 'out')
+    result = jobs.run_job(opts + ['--profile-json', profile,
+                                  filename, out_prefix])
+    if result['exit_code'] & ~exit_code.DATA_ERROR_EXIT:
+        raise RuntimeError('Converting %s failed:\n%s' % (
+            filename, result['diagnostics']))
+    with open(profile) as f:
+        return json.load(f)
+
+
+def summarize(profiles):
+    """Aggregate the stages of several runs (all times in ms)."""
+    ans = OrderedDict()
+    for name in profiles[0]['stages']:
+        runs = [p['stages'][name] for p in profiles if name in p['stages']]
+        wall = [1000 * r['wall'] for r in runs]
+        cpu = [1000 * (r['cpu'] + r['children_cpu']) for r in runs]
+        ans[name] = OrderedDict([
+            ('median_ms', round(median(wall), 2)),
+            ('min_ms', round(min(wall), 2)),
+            ('max_ms', round(max(wall), 2)),
+            ('cpu_median_ms', round(median(cpu), 2)),
+            ('peak_rss_kb', max(r['peak_rss_kb'] for r in runs)),
+            ('children_peak_rss_kb',
+             max(r['children_peak_rss_kb'] for r in runs)),
+        ])
+    total = [1000 * p['total_wall'] for p in profiles]
+    ans['total'] = OrderedDict([('median_ms', round(median(total), 2)),
+                                ('min_ms', round(min(total), 2)),
+                                ('max_ms', round(max(total), 2))])
+    return ans
+
+
+def bench(filename, opts, reps, warmup):
+    work_dir = tempfile.mkdtemp(prefix='typesetr-bench')
+    try:
+        for _ in range(warmup):
+            profile_once(filename, opts, work_dir)
+        profiles = [profile_once(filename, opts, work_dir)
+                    for _ in range(reps)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return OrderedDict([('stages', summarize(profiles)),
+                        ('counts', profiles[-1]['counts'])])
+
+
+def bench_scaling(param, values, base, format, opts, reps, warmup):
+    """Benchmark synthetic documents with `param` set to each of `values`."""
+    work_dir = tempfile.mkdtemp(prefix='typesetr-scale')
+    ans = OrderedDict()
+    try:
+        for value in values:
+            size = synthetic.Size(**dict(base, **{param: value}))
+            name = '%s=%d.%s' % (param, value, format)
+            filename = os.path.join(work_dir, name)
+            print >> sys.stderr, 'Benchmarking %r...' % (size,)
+            synthetic.make_document(filename, size)
+            ans[name] = bench(filename, opts, reps, warmup)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return ans
+
+
+def print_scaling(param, results):
+    """Print median time (ms) and peak RSS (MB) per stage against size."""
+    names = results.keys()
+    stages = []
+    for result in results.itervalues():
+        stages.extend(s for s in result['stages'] if s not in stages)
+    print >> sys.stderr, '%-20s' % param + ''.join(
+        '%16s' % n.split('=', 1)[1].rsplit('.', 1)[0] for n in names)
+    for stage in stages:
+        cells = []
+        for name in names:
+            r = results[name]['stages'].get(stage)
+            cells.append('%16s' % ('-' if r is None else
+                                   '%.1fms/%dMB' % (
+                                       r['median_ms'],
+                                       r.get('peak_rss_kb', 0) // 1024)))
+        print >> sys.stderr, '%-20s' % stage + ''.join(cells)
+
+
+def _scale_spec(s):
+    try:
+        param, values = s.split('=')
+        values = map(int, values.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected PARAM=N,N,..., got %r' % s)
+    if param not in synthetic.Size._fields:
+        raise argparse.ArgumentTypeError('PARAM must be one of %s' % ', '.join(
+            synthetic.Size._fields))
+    return param, values
+
+
+def _size_spec(s):
+    return dict((k, int(v)) for k, v in (kv.split('=') for kv in s.split(',')
+                                          if kv))
+
+
+def compare(results, baseline, threshold, min_ms):
+    """Print a comparison with `baseline`; return the regressions."""
+    regressions = []
+    for name, result in results['files'].iteritems():
+        base = baseline['files'].get(name)
+        if base is None:
+            print >> sys.stderr, '%s: not in baseline' % name
+            continue
+        print >> sys.stderr, name
+        for stage, cur in result['stages'].iteritems():
+            old = base['stages'].get(stage)
+            if old is None:
+                continue
+            delta = cur['median_ms'] - old['median_ms']
+            pct = 100. * delta / old['median_ms'] if old['median_ms'] else 0.
+            regressed = pct > threshold and delta > min_ms
+            print >> sys.stderr, '  %-20s %10.2f -> %10.2f ms %+7.1f%%%s' % (
+                stage, old['median_ms'], cur['median_ms'], pct,
+                ' REGRESSION' if regressed else '')
+            if regressed:
+                regressions.append((name, stage, pct))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('files', nargs='*', default=FIXTURES,
+        help='Documents to convert (default: the benchmark fixtures)')
+    arg('--reps', '-n', type=int, default=5,
+        help='Timed repetitions per file')
+    arg('--warmup', type=int, default=1,
+        help='Untimed runs per file before timing')
+    arg('--format', '-f', default='tex,html',
+        help='Output format(s) to produce (pdf/png need LaTeX)')
+    arg('--style', '-s', default='typesetr/HTML5')
+    arg('--style-base', default=typesetr_root('styles'))
+    arg('--scale', metavar='PARAM=N,N,...', type=_scale_spec,
+        help=('Benchmark synthetic documents with PARAM (%s) set to each N'
+              ' instead of FILES' % ', '.join(synthetic.Size._fields)))
+    arg('--scale-base', metavar='PARAM=N,...', type=_size_spec, default={},
+        help='The other size parameters for --scale, e.g. pages=10,images=2')
+    arg('--scale-format', choices=['odt', 'docx'], default='odt',
+        help='The format of the synthetic documents')
+    arg('--output', '-o', help='Write the JSON results here (default: stdout)')
+    arg('--compare', metavar='BASELINE',
+        help='Compare with the JSON results of an earlier run')
+    arg('--threshold', type=float, default=10.,
+        help='Slowdown in percent that counts as a regression')
+    arg('--min-ms', type=float, default=5.,
+        help='Ignore slowdowns below this many milliseconds')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    opts = ['-q', '-f', args.format,
+            '--style', args.style, '--style-base', args.style_base]
+    results = OrderedDict([
+        ('python', platform.python_version()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('reps', args.reps),
+        ('warmup', args.warmup),
+        ('options', opts),
+        ('files', OrderedDict())])
+    if args.scale:
+        param, values = args.scale
+        results['files'] = bench_scaling(param, values, args.scale_base,
+                                         args.scale_format, opts,
+                                         args.reps, args.warmup)
+        print_scaling(param, results['files'])
+    else:
+        for filename in args.files:
+            print >> sys.stderr, 'Benchmarking %s...' % filename
+            results['files'][os.path.basename(filename)] = bench(
+                os.path.abspath(filename), opts, args.reps, args.warmup)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print json.dumps(results, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_ms)
+        if regressions:
+            print >> sys.stderr, '%d regression(s)' % len(regressions)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""USAGE: %prog [--entries N] [--cited K] [--reps N] [-o OUT.json]
+
+Benchmark handing biber only the cited bibliography entries.
+
+A synthetic ``.bib`` with ``--entries`` entries (every tenth one a
+``crossref`` child) is generated together with a small biblatex document that
+cites ``--cited`` of them. We then time `converter.bibdb.filter_bib` and biber
+on the full and on the filtered bibliography (median of ``--reps`` runs).
+biber needs a ``.bcf``, so one xelatex run is done first; without xelatex and
+biber only the filtering is timed.
+"""
+
+# pylint: disable=C0103,C0111
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from converter import bibdb
+
+from benchmark import median
+
+DOCUMENT = r'''\documentclass{article}
+\usepackage[backend=biber]{biblatex}
+\addbibresource{bibliography.bib}
+\begin{document}
+%s
+\printbibliography
+\end{document}
+'''
+
+
+def make_bib(n, seed=0):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(n):
+        if i % 10 == 9:
+            entries.append('@inproceedings{key%d,\n  author = {Author %d},\n'
+                           '  title = {Paper %d},\n  pages = {%d--%d},\n'
+                           '  crossref = {key%d},\n}\n' % (
+                               i, rng.randint(0, n), i, i, i + 10, i - 9))
+        else:
+            entries.append('@book{key%d,\n  author = {Author %d and Other %d},'
+                           '\n  title = {Book number %d},\n  year = {%d},\n'
+                           '  publisher = {Publisher},\n}\n' % (
+                               i, rng.randint(0, n), rng.randint(0, n), i,
+                               rng.randint(1900, 2015)))
+    return ''.join(entries)
+
+
+def time_it(f, reps):
+    walls = []
+    for _ in range(reps):
+        tic = time.time()
+        f()
+        walls.append(time.time() - tic)
+    return round(1000 * median(walls), 2)
+
+
+def run_biber(work_dir, bib):
+    with open(os.path.join(work_dir, 'bibliography.bib'), 'w') as f:
+        f.write(bib)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['biber', 'doc'], cwd=work_dir, stdout=devnull)
+
+
+def has(program):
+    return any(os.access(os.path.join(d, program), os.X_OK)
+               for d in os.environ.get('PATH', '').split(os.pathsep))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('--entries', type=int, default=5000,
+        help='Entries in the synthetic bibliography')
+    arg('--cited', type=int, default=30, help='How many of them to cite')
+    arg('--reps', '-n', type=int, default=3, help='Timed runs')
+    arg('--seed', type=int, default=0)
+    arg('--output', '-o', help='Write the JSON results here (default: stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bib = make_bib(args.entries, args.seed)
+    keys = ['key%d' % i for i in random.Random(args.seed).sample(
+        range(args.entries), args.cited)]
+    filtered = bibdb.filter_bib(bib, keys)
+    results = OrderedDict([
+        ('entries', args.entries),
+        ('cited', args.cited),
+        ('kept', sum(1 for _ in bibdb.split_entries(filtered))),
+        ('bib_bytes', len(bib)),
+        ('filtered_bytes', len(filtered)),
+        ('filter_ms', time_it(lambda: bibdb.filter_bib(bib, keys), args.reps))])
+    if has('xelatex') and has('biber'):
+        work_dir = tempfile.mkdtemp(prefix='typesetr-bib')
+        try:
+            with open(os.path.join(work_dir, 'doc.tex'), 'w') as f:
+                f.write(DOCUMENT % '\n'.join(r'\autocite{%s}' % key
+                                             for key in keys))
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call(['xelatex', '-interaction=nonstopmode',
+                                       'doc.tex'], cwd=work_dir,
+                                      stdout=devnull)
+            results['biber_full_ms'] = time_it(
+                lambda: run_biber(work_dir, bib), args.reps)
+            results['biber_filtered_ms'] = time_it(
+                lambda: run_biber(work_dir, filtered), args.reps)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        print >> sys.stderr, 'No xelatex/biber, only timing the filtering'
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print json.dumps(results, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
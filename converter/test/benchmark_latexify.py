@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""USAGE: %prog [--reps N] [--jobs N,...] [-o OUT.json] [FILE]
+
+Benchmark parallel LaTeX generation (``gdoc-to --latexify-jobs``).
+
+FILE (default: the large benchmark fixture) is converted to tex ``--reps``
+times for every number of ``--jobs``, and the median of the ``writer.tex``
+stage is reported. The outputs are checked to be identical to the serial
+one.
+"""
+
+# pylint: disable=C0103,C0111
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmark import median, profile_once, test_root
+
+
+def _int_list(s):
+    return [int(n) for n in s.split(',')]
+
+
+def bench_jobs(filename, jobs, reps):
+    work_dir = tempfile.mkdtemp(prefix='typesetr-latexify')
+    try:
+        walls = []
+        for _ in range(reps):
+            profile = profile_once(filename, ['-f', 'tex', '--latexify-jobs',
+                                              str(jobs)], work_dir)
+            walls.append(1000 * profile['stages']['writer.tex']['wall'])
+        with open(os.path.join(work_dir, 'out'), 'rb') as f:
+            output = f.read()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return round(median(walls), 2), output
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('file', nargs='?', default=test_root('benchmark_files', 'large.odt'))
+    arg('--reps', '-n', type=int, default=5, help='Timed runs per setting')
+    arg('--jobs', '-j', type=_int_list, default=[1, 2, 4],
+        help='Comma-separated numbers of processes to try (default: 1,2,4)')
+    arg('--output', '-o', help='Write the JSON results here (default: stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = OrderedDict([('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                           ('file', os.path.basename(args.file)),
+                           ('reps', args.reps),
+                           ('writer_tex_median_ms', OrderedDict())])
+    serial = None
+    ok = True
+    for jobs in [1] + [n for n in args.jobs if n != 1]:
+        ms, output = bench_jobs(args.file, jobs, args.reps)
+        results['writer_tex_median_ms'][str(jobs)] = ms
+        print >> sys.stderr, '%d job(s): %.1fms' % (jobs, ms)
+        if serial is None:
+            serial = output
+        elif output != serial:
+            print >> sys.stderr, '  output differs from the serial one!'
+            ok = False
+    results['identical'] = ok
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print json.dumps(results, indent=2)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
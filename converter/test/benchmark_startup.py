@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""USAGE: %prog [--reps N] [-o OUT.json] [FORMAT:FILE...]
+
+Benchmark gdoc-to's startup, i.e. interpreter start and imports.
+
+For every FORMAT:FILE case (default: a few typical ones), ``gdoc-to -f FORMAT
+FILE`` is run ``--reps`` times as a fresh process and the median wall-clock
+time is reported. One more run records every import (in the spirit of
+``python -X importtime``, which python 2 lacks): the self and cumulative
+import time of every module that got loaded, summed up by top-level package,
+so that it's easy to see e.g. whether ``-f meta`` still pulls in pygments.
+"""
+
+# pylint: disable=C0103,C0111,W0622
+
+import __builtin__
+import argparse
+from collections import OrderedDict
+from functools import partial
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+test_root = partial(os.path.join, os.path.dirname(os.path.realpath(__file__)))
+gdoc_to = test_root('..', 'gdoc-to')
+
+CASES = ['meta:' + test_root('benchmark_files', 'normal.odt'),
+         'html:' + test_root('benchmark_files', 'normal.odt'),
+         'tex:' + test_root('benchmark_files', 'normal.odt'),
+         'html:' + test_root('benchmark_files', 'normal.md'),
+         'tex:' + test_root('data', 'comprehensive-test-from-odt.docx')]
+
+
+def record_imports():
+    """Wrap `__import__` to time every import that loads new modules.
+
+    Returns a list that gets filled with ``(module, self_s, cumulative_s)``
+    tuples.
+    """
+    real_import = __builtin__.__import__
+    records = []
+    nested = []
+    def timed_import(name, *args, **kwargs):
+        n_modules = len(sys.modules)
+        nested.append(0.)
+        tic = time.time()
+        try:
+            module = real_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - tic
+            inner = nested.pop()
+            if nested:
+                nested[-1] += elapsed
+        if len(sys.modules) > n_modules:
+            records.append((getattr(module, '__name__', name),
+                            elapsed - inner, elapsed))
+        return module
+    __builtin__.__import__ = timed_import
+    return records
+
+
+def child_main(out, argv):
+    """Run gdoc-to with `argv` in-process, recording imports to `out`."""
+    records = record_imports()
+    tic = time.time()
+    sys.path.insert(0, test_root('..'))
+    # pylint: disable=F0401
+    from converter import gdoc_converter
+    try:
+        gdoc_converter.main(argv)
+    except SystemExit:
+        pass
+    elapsed = time.time() - tic
+    with open(out, 'w') as f:
+        json.dump({'elapsed': elapsed, 'imports': records}, f)
+
+
+def summarize_imports(records, top):
+    by_package = OrderedDict()
+    for name, self_s, _ in records:
+        package = name.split('.')[0]
+        by_package[package] = by_package.get(package, 0.) + self_s
+    return OrderedDict([
+        ('import_ms', round(1000 * sum(r[1] for r in records), 2)),
+        ('modules', len(records)),
+        ('packages', OrderedDict(
+            (p, round(1000 * s, 2))
+            for p, s in sorted(by_package.items(), key=lambda x: -x[1]))),
+        ('slowest', [OrderedDict([('module', n),
+                                  ('self_ms', round(1000 * s, 2)),
+                                  ('cumulative_ms', round(1000 * c, 2))])
+                     for n, s, c in sorted(records,
+                                           key=lambda r: -r[1])[:top]])])
+
+
+def bench_case(case, reps, top):
+    # not imported at the top: it loads the converter, and the --child run
+    # must start without it
+    from benchmark import median
+    format, filename = case.split(':', 1)
+    work_dir = tempfile.mkdtemp(prefix='typesetr-startup')
+    argv = ['-q', '-f', format, filename,
+            os.path.join(work_dir, 'out.' + format)]
+    walls = []
+    for _ in range(reps):
+        tic = time.time()
+        subprocess.call([sys.executable, gdoc_to] + argv)
+        walls.append(time.time() - tic)
+    imports_json = os.path.join(work_dir, 'imports.json')
+    subprocess.check_call([sys.executable, os.path.realpath(__file__),
+                           '--child', imports_json] + argv)
+    with open(imports_json) as f:
+        child = json.load(f)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    ans = OrderedDict([('wall_median_ms', round(1000 * median(walls), 2)),
+                       ('wall_min_ms', round(1000 * min(walls), 2))])
+    ans.update(summarize_imports(child['imports'], top))
+    return ans
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    arg('cases', nargs='*', default=CASES, metavar='FORMAT:FILE',
+        help='Conversions to time (default: a few typical ones)')
+    arg('--reps', '-n', type=int, default=5,
+        help='Timed runs per case')
+    arg('--top', type=int, default=15,
+        help='Report this many of the slowest imports per case')
+    arg('--output', '-o', help='Write the JSON results here (default: stdout)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--child']: # see bench_case
+        child_main(argv[1], argv[2:])
+        return 0
+    args = parse_args(argv)
+    results = OrderedDict([('python', sys.version.split()[0]),
+                           ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                           ('reps', args.reps),
+                           ('cases', OrderedDict())])
+    for case in args.cases:
+        print >> sys.stderr, 'Timing %s...' % case
+        result = results['cases'][case] = bench_case(case, args.reps, args.top)
+        print >> sys.stderr, '  %.1fms wall, %.1fms in %d imports: %s' % (
+            result['wall_median_ms'], result['import_ms'], result['modules'],
+            ', '.join('%s %.1fms' % kv
+                      for kv in result['packages'].items()[:6]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print json.dumps(results, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
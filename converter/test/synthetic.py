@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""USAGE: %prog [--pages N] [--images N] [--table-rows N] [--table-cols N]
+                [--footnotes N] [--list-depth N] OUT.(odt|docx)
+
+Generate synthetic documents of a given size for scaling tests.
+
+A document has `pages` sections (a level 1 heading and enough text for about
+a page each), `images` images and `footnotes` footnotes spread evenly over
+the sections, one table of `table_rows` x `table_cols` (with a bold header
+row) and, if `list_depth` is positive, a bullet list nested `list_depth`
+levels deep in every section.
+
+ODT documents are built from ``styles/odt_template.odt`` and the markup
+templates in `converter.odt_writer`; DOCX documents from the docx test
+document (stripped of its body) via `converter.docxlite`. The output is
+deterministic for a given `seed`.
+"""
+
+# pylint: disable=C0103,C0111
+
+import argparse
+from cStringIO import StringIO
+from collections import namedtuple
+from functools import partial
+import os
+import random
+import sys
+import zipfile
+
+import PIL.Image
+import PIL.ImageDraw
+
+from converter import docxlite
+from converter import odt_writer
+from converter.odt_writer import t
+from converter.xml_namespaces import docx_ns
+from converter.xmltools import to_etree
+
+test_root = partial(os.path.join, os.path.dirname(os.path.realpath(__file__)))
+typesetr_root = partial(test_root, '..', '..')
+
+ODT_TEMPLATE = typesetr_root('styles', 'odt_template.odt')
+DOCX_TEMPLATE = test_root('data', 'comprehensive-test-from-odt.docx')
+
+PARAS_PER_PAGE = 5
+WORDS_PER_PARA = 90
+IMAGE_PX = (1200, 900)
+IMAGE_WIDTH_CM = 12.
+TABLE_WIDTH_CM = 16.
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do'
+         ' eiusmod tempor incididunt ut labore et dolore magna aliqua enim'
+         ' ad minim veniam quis nostrud exercitation ullamco laboris nisi'
+         ' aliquip ex ea commodo consequat duis aute irure in reprehenderit'
+         ' voluptate velit esse cillum fugiat nulla pariatur').split()
+
+Size = namedtuple('Size', 'pages images table_rows table_cols'
+                  ' footnotes list_depth')
+Size.__new__.__defaults__ = (1, 0, 0, 3, 0, 0)
+
+
+def make_png(n, size=IMAGE_PX):
+    """A PNG that is different for every `n`."""
+    rnd = random.Random(n)
+    im = PIL.Image.new('RGB', size, tuple(rnd.randrange(256) for _ in 'rgb'))
+    draw = PIL.ImageDraw.Draw(im)
+    for _ in range(20):
+        x, y = rnd.randrange(size[0]), rnd.randrange(size[1])
+        draw.rectangle([x, y, x + rnd.randrange(size[0]//4),
+                        y + rnd.randrange(size[1]//4)],
+                       fill=tuple(rnd.randrange(256) for _ in 'rgb'))
+    out = StringIO()
+    im.save(out, 'png')
+    return out.getvalue()
+
+
+def _spread(n, buckets):
+    """How many of `n` things go into each of `buckets`."""
+    return [n // buckets + (i < n % buckets) for i in range(buckets)]
+
+
+def blocks(size, seed=0):
+    """The document structure, as a format independent list of blocks.
+
+    Blocks are ``('title', text)``, ``('h1', text)``, ``('p', text,
+    footnote_texts)``, ``('img', n)``, ``('table', rows)`` and ``('ul',
+    depth)``.
+    """
+    rnd = random.Random(seed)
+    words = lambda n: ' '.join(rnd.choice(WORDS) for _ in range(n))
+    pages = max(size.pages, 1)
+    images = iter(range(size.images))
+    ans = [('title', 'Synthetic document')]
+    footnote_counts = _spread(size.footnotes, pages * PARAS_PER_PAGE)
+    for page, image_count in enumerate(_spread(size.images, pages)):
+        ans.append(('h1', 'Section %d %s' % (page + 1, words(3))))
+        for i in range(PARAS_PER_PAGE):
+            notes = footnote_counts[page * PARAS_PER_PAGE + i]
+            ans.append(('p', words(WORDS_PER_PARA),
+                        [words(12) for _ in range(notes)]))
+        if size.list_depth > 0:
+            ans.append(('ul', size.list_depth))
+        ans.extend(('img', next(images)) for _ in range(image_count))
+        if page == 0 and size.table_rows:
+            ans.append(('table', [['Column %d' % (j + 1)
+                                   for j in range(size.table_cols)]] +
+                        [[words(2) for _ in range(size.table_cols)]
+                         for _ in range(size.table_rows - 1)]))
+    return ans
+
+
+# ODT
+
+ODT_HEADING_TEMPLATE = t('<text:h text:style-name="Heading_20_1"'
+                         ' text:outline-level="1">%s</text:h>')
+ODT_NOTE_TEMPLATE = t(
+    '<text:note text:id="ftn%(n)d" text:note-class="footnote">'
+    '<text:note-citation>%(n)d</text:note-citation>'
+    '<text:note-body><text:p>%(body)s</text:p></text:note-body></text:note>')
+ODT_LIST_TEMPLATE = t('<text:list%s>%s</text:list>')
+ODT_LIST_ITEM_TEMPLATE = t('<text:list-item>%s</text:list-item>')
+ODT_TABLE_TEMPLATE = t('<table:table table:name="Table%s">%s</table:table>')
+ODT_TABLE_COLUMN_TEMPLATE = t('<table:table-column table:style-name="%s"/>')
+ODT_TABLE_COLUMN_STYLE_TEMPLATE = t(
+    '<style:style style:name="%s" style:family="table-column">'
+    '<style:table-column-properties style:column-width="%.3fcm"/>'
+    '</style:style>')
+ODT_TABLE_ROW_TEMPLATE = t('<table:table-row>%s</table:table-row>')
+ODT_TABLE_CELL_TEMPLATE = t('<table:table-cell office:value-type="string">'
+                            '<text:p>%s</text:p></table:table-cell>')
+ODT_BULLETS = u'\u25cf\u25cb\u25a0' # as in converter.odt_parser
+ODT_LIST_STYLE = ('<text:list-style style:name="L1">%s</text:list-style>' %
+                  ''.join('<text:list-level-style-bullet text:level="%d"'
+                          ' text:bullet-char="%s"/>' % (
+                              i + 1, ODT_BULLETS[i % 3])
+                          for i in range(10))).encode('utf-8')
+
+
+def _odt_column_names(cols):
+    # as named by real ODT exports: Table1.A, Table1.B, ...
+    return ['Table1.' + chr(ord('A') + j) for j in range(cols)]
+
+
+def _odt_list(depth, level=1):
+    para = odt_writer.ODT_PARAGRAPH_TEMPLATE
+    items = [para('Item on level %d' % level), para('Another item')]
+    if level < depth:
+        items[-1] += _odt_list(depth, level + 1)
+    # only the outermost list names the list style
+    return ODT_LIST_TEMPLATE(' text:style-name="L1"' if level == 1 else '',
+                             ''.join(map(ODT_LIST_ITEM_TEMPLATE, items)))
+
+
+def odt_body(size, seed=0):
+    frags = []
+    notes = iter(range(1, size.footnotes + 1))
+    bold = lambda s: odt_writer.ODT_SPAN_TEMPLATE('Bold', s)
+    for block in blocks(size, seed):
+        kind = block[0]
+        if kind == 'title':
+            frags.append(odt_writer.ODT_TITLE_TEMPLATE(block[1]))
+        elif kind == 'h1':
+            frags.append(ODT_HEADING_TEMPLATE(block[1]))
+        elif kind == 'p':
+            first, rest = block[1].split(' ', 1)
+            frags.append(odt_writer.ODT_PARAGRAPH_TEMPLATE(
+                bold(first) + ' ' + odt_writer.odtify_basestring(rest) +
+                ''.join(ODT_NOTE_TEMPLATE(n=next(notes), body=note)
+                        for note in block[2])))
+        elif kind == 'img':
+            frags.append(odt_writer.ODT_PARAGRAPH_TEMPLATE(
+                odt_writer.ODT_IMAGE_TEMPLATE(
+                    href='Pictures/image%d.png' % block[1],
+                    width=IMAGE_WIDTH_CM,
+                    height=IMAGE_WIDTH_CM * IMAGE_PX[1] / IMAGE_PX[0],
+                    anchor='as-char')))
+        elif kind == 'ul':
+            frags.append(_odt_list(block[1]))
+        elif kind == 'table':
+            rows = block[1]
+            frags.append(ODT_TABLE_TEMPLATE(
+                1, ''.join(map(ODT_TABLE_COLUMN_TEMPLATE,
+                               _odt_column_names(len(rows[0])))) + ''.join(
+                    ODT_TABLE_ROW_TEMPLATE(''.join(
+                        ODT_TABLE_CELL_TEMPLATE(
+                            bold(cell) if i == 0 else cell)
+                        for cell in row))
+                    for (i, row) in enumerate(rows))))
+    return ''.join(frags)
+
+
+def make_odt(out, size, seed=0):
+    """Write an ODT document of `size` (see `Size`) to the file `out`."""
+    with zipfile.ZipFile(ODT_TEMPLATE) as template:
+        parts = dict((n, template.read(n)) for n in template.namelist())
+    content = parts['content.xml']
+    head, rest = content.split('<office:text>', 1)
+    _, tail = rest.split('</office:text>', 1)
+    styles = (odt_writer.ODT_TEXT_STYLE_TEMPLATE(
+        'Bold', odt_writer.ODT_MINIMAL_STYLES['Bold']) +
+              odt_writer.ODT_IMAGE_STYLE_TEMPLATE % 'Image' + ODT_LIST_STYLE)
+    if size.table_rows:
+        styles += ''.join(ODT_TABLE_COLUMN_STYLE_TEMPLATE(
+            name, TABLE_WIDTH_CM / size.table_cols)
+                          for name in _odt_column_names(size.table_cols))
+    head = head.replace('</office:automatic-styles>',
+                        styles + '</office:automatic-styles>')
+    parts['content.xml'] = (head + '<office:text>' + odt_body(size, seed) +
+                            '</office:text>' + tail)
+    pictures = ['Pictures/image%d.png' % n for n in range(size.images)]
+    parts['META-INF/manifest.xml'] = parts['META-INF/manifest.xml'].replace(
+        '</manifest:manifest>', ''.join(
+            '<manifest:file-entry manifest:media-type="image/png"'
+            ' manifest:full-path="%s" />' % p for p in pictures) +
+        '</manifest:manifest>')
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as z:
+        # the mimetype must come first and be uncompressed
+        z.writestr('mimetype', parts.pop('mimetype'),
+                   compress_type=zipfile.ZIP_STORED)
+        for name in sorted(parts):
+            z.writestr(name, parts[name])
+        for n, name in enumerate(pictures):
+            z.writestr(name, make_png(n), compress_type=zipfile.ZIP_STORED)
+
+
+# DOCX
+
+DOCX_RUN_TEMPLATE = t('<w:r><w:t xml:space="preserve">%s</w:t></w:r>')
+DOCX_BOLD_RUN_TEMPLATE = t('<w:r><w:rPr><w:b w:val="1"/></w:rPr>'
+                           '<w:t xml:space="preserve">%s</w:t></w:r>')
+DOCX_PARAGRAPH_TEMPLATE = t('<w:p>%s</w:p>')
+DOCX_STYLED_PARAGRAPH_TEMPLATE = t(
+    '<w:p><w:pPr><w:pStyle w:val="%s"/></w:pPr>%s</w:p>')
+DOCX_LIST_ITEM_TEMPLATE = t(
+    '<w:p><w:pPr><w:numPr><w:ilvl w:val="%d"/><w:numId w:val="1"/>'
+    '</w:numPr></w:pPr>%s</w:p>')
+DOCX_FOOTNOTE_REF_TEMPLATE = t(
+    '<w:r><w:rPr><w:vertAlign w:val="superscript"/></w:rPr>'
+    '<w:footnoteReference w:id="%d"/></w:r>')
+DOCX_FOOTNOTE_TEMPLATE = t('<w:footnote w:id="%d"><w:p>%s</w:p></w:footnote>')
+DOCX_IMAGE_TEMPLATE = t(
+    '<w:r><w:drawing><wp:inline distR="0" distT="0" distB="0" distL="0">'
+    '<wp:extent cy="%(cy)d" cx="%(cx)d"/><wp:docPr id="%(n)d" name="%(rid)s"/>'
+    '<a:graphic><a:graphicData'
+    ' uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="%(rid)s"/><pic:cNvPicPr/>'
+    '</pic:nvPicPr><pic:blipFill><a:blip r:embed="%(rid)s"/><a:stretch>'
+    '<a:fillRect/></a:stretch></pic:blipFill><pic:spPr><a:xfrm>'
+    '<a:ext cy="%(cy)d" cx="%(cx)d"/></a:xfrm><a:prstGeom prst="rect"/>'
+    '</pic:spPr></pic:pic></a:graphicData></a:graphic></wp:inline>'
+    '</w:drawing></w:r>')
+DOCX_TABLE_TEMPLATE = t('<w:tbl><w:tblPr><w:tblLook w:firstRow="1"/></w:tblPr>'
+                        '<w:tblGrid>%s</w:tblGrid>%s</w:tbl>')
+DOCX_TABLE_ROW_TEMPLATE = t('<w:tr>%s</w:tr>')
+DOCX_TABLE_CELL_TEMPLATE = t('<w:tc><w:p>%s</w:p></w:tc>')
+EMU_PER_CM = 360000
+
+
+def _docx_fragments(xml):
+    return list(to_etree('<w:body %s>%s</w:body>' % (docx_ns, xml),
+                         strip=False))
+
+
+def _clear_images(doc):
+    """Remove the template's images (but not e.g. its header and footer)."""
+    for rid, rel in doc.document.rels.items():
+        if rel.attrib['Type'] == docxlite.IMAGE_REL_URI:
+            del doc.document.rels[rid]
+            doc.z.pop(docxlite.MAGIC_WORD + '/' + rel.attrib['Target'], None)
+
+
+def make_docx(out, size, seed=0):
+    """Write a DOCX document of `size` (see `Size`) to the file `out`."""
+    esc = lambda s: s.replace('&', '&amp;').replace('<', '&lt;')
+    run = lambda s: DOCX_RUN_TEMPLATE(esc(s))
+    doc = docxlite.Document(DOCX_TEMPLATE)
+    _clear_images(doc)
+    frags, notes = [], []
+    for block in blocks(size, seed):
+        kind = block[0]
+        if kind == 'title':
+            frags.append(DOCX_STYLED_PARAGRAPH_TEMPLATE('Title',
+                                                        run(block[1])))
+        elif kind == 'h1':
+            frags.append(DOCX_STYLED_PARAGRAPH_TEMPLATE('Heading1',
+                                                        run(block[1])))
+        elif kind == 'p':
+            first, rest = block[1].split(' ', 1)
+            refs = []
+            for note in block[2]:
+                notes.append(DOCX_FOOTNOTE_TEMPLATE(len(notes) + 1, run(note)))
+                refs.append(DOCX_FOOTNOTE_REF_TEMPLATE(len(notes)))
+            frags.append(DOCX_PARAGRAPH_TEMPLATE(
+                DOCX_BOLD_RUN_TEMPLATE(esc(first)) + run(' ' + rest) +
+                ''.join(refs)))
+        elif kind == 'img':
+            rid = doc.add_image(StringIO(make_png(block[1])), 'image/png')
+            cx = int(IMAGE_WIDTH_CM * EMU_PER_CM)
+            frags.append(DOCX_PARAGRAPH_TEMPLATE(DOCX_IMAGE_TEMPLATE(
+                n=block[1] + 1, rid=rid,
+                cx=cx, cy=cx * IMAGE_PX[1] // IMAGE_PX[0])))
+        elif kind == 'ul':
+            for level in range(min(block[1], 9)):
+                frags.append(DOCX_LIST_ITEM_TEMPLATE(
+                    level, run('Item on level %d' % (level + 1))))
+                frags.append(DOCX_LIST_ITEM_TEMPLATE(level,
+                                                     run('Another item')))
+        elif kind == 'table':
+            rows = block[1]
+            frags.append(DOCX_TABLE_TEMPLATE(
+                '<w:gridCol w:w="2000"/>' * len(rows[0]),
+                ''.join(DOCX_TABLE_ROW_TEMPLATE(''.join(
+                    DOCX_TABLE_CELL_TEMPLATE(
+                        (DOCX_BOLD_RUN_TEMPLATE if i == 0 else
+                         DOCX_RUN_TEMPLATE)(esc(cell)))
+                    for cell in row))
+                        for (i, row) in enumerate(rows))))
+    body = doc.document.e.find(docx_ns.w('body'))
+    sect_pr = body[-1]
+    body[:] = _docx_fragments(''.join(frags)) + [sect_pr]
+    if doc.footnotes.e is not None:
+        doc.footnotes.e[:] = _docx_fragments(''.join(notes))
+    else:
+        assert not notes, "The docx template has no footnotes part"
+    doc.save(out)
+
+
+def make_document(out, size, seed=0):
+    """Write a document of `size`; the format is taken from `out`'s name."""
+    if out.endswith('.docx'):
+        make_docx(out, size, seed)
+    elif out.endswith('.odt'):
+        make_odt(out, size, seed)
+    else:
+        raise ValueError('Can only make .odt and .docx files, not %s' % out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg = parser.add_argument
+    defaults = Size()
+    for field in Size._fields:
+        arg('--' + field.replace('_', '-'), type=int,
+            default=getattr(defaults, field))
+    arg('--seed', type=int, default=0)
+    arg('out', help='The .odt or .docx file to write')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    make_document(args.out, Size(*[getattr(args, f) for f in Size._fields]),
+                  args.seed)
+
+if __name__ == '__main__':
+    sys.exit(main())
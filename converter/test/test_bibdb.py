@@ -0,0 +1,56 @@
+from converter import bibdb
+from converter.diskcache import DiskCache
+
+BIB = r'''% exported from Zotero
+@String{ acm = "ACM" }
+@Article{Knuth84,
+  title = {Literate {Programming}},
+  journal = "The Computer Journal",
+}
+@book(lamport86,
+  title = {{\LaTeX}: A Document Preparation System},
+  xref = {series, other}
+)
+@collection{series, title = {Series}, crossref = "root"}
+@misc{root, title = {Root}}
+@misc{other, title = {Other}}
+@misc{unrelated, publisher = acm}
+'''
+
+def keys(text):
+    return [key for _, key, _ in bibdb.split_entries(text) if key]
+
+def test_split_entries():
+    assert keys(BIB) == ['Knuth84', 'lamport86', 'series', 'root', 'other',
+                         'unrelated']
+    assert list(bibdb.split_entries(BIB))[0] == (
+        'string', None, '@String{ acm = "ACM" }')
+
+def test_split_paren_entries_with_quotes():
+    text = ('@article(quoted, title = "A (b) c", note = "{\\"o})")\n'
+            '@misc(next, title = {D (e)})\n')
+    assert list(bibdb.split_entries(text)) == [
+        ('article', 'quoted',
+         '@article(quoted, title = "A (b) c", note = "{\\"o})")'),
+        ('misc', 'next', '@misc(next, title = {D (e)})')]
+
+def test_filter_bib():
+    assert keys(bibdb.filter_bib(BIB, ['knuth84'])) == ['Knuth84']
+    assert keys(bibdb.filter_bib(BIB, ['lamport86', 'missing'])) == [
+        'lamport86', 'series', 'root', 'other']
+    assert '@String{ acm = "ACM" }' in bibdb.filter_bib(BIB, [])
+    assert keys(bibdb.filter_bib(BIB, [])) == []
+
+def test_load(tmpdir, monkeypatch):
+    monkeypatch.setattr(bibdb, '_PARSED', bibdb.OrderedDict())
+    bib_file = tmpdir.join('refs.bib')
+    bib_file.write(BIB)
+    cache = DiskCache(str(tmpdir.join('cache')), max_bytes=2**20)
+    bib = bibdb.load(str(bib_file), cache)
+    assert bib.entries['lamport86'].fields['title'] == (
+        '{\\LaTeX}: A Document Preparation System')
+    assert bibdb.load(str(bib_file), cache) is bib
+    # not in memory anymore, but on disk
+    bibdb._PARSED.clear()
+    assert list(bibdb.load(str(bib_file), cache).entries) == list(bib.entries)
+    assert len(cache.keys()) == 1
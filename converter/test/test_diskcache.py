@@ -0,0 +1,47 @@
+import os
+
+from converter.diskcache import DiskCache, cache_key
+
+def test_cache_key():
+    assert cache_key('a', u'\xe4', 1) == cache_key('a', u'\xe4'.encode('utf-8'), 1)
+    assert cache_key('ab', 'c') != cache_key('a', 'bc')
+
+def test_get_put(tmpdir):
+    cache = DiskCache(str(tmpdir), max_bytes=1000)
+    key = cache_key('doc')
+    assert cache.get(key) is None
+    cache.put(key, {'pdf': 'PDF', 'diagnostics': ''})
+    assert cache.get(key) == {'pdf': 'PDF', 'diagnostics': ''}
+    # storing the same thing twice is harmless
+    cache.put(key, {'pdf': 'PDF', 'diagnostics': ''})
+    assert cache.get(key) == {'pdf': 'PDF', 'diagnostics': ''}
+
+def test_lru_eviction(tmpdir):
+    cache = DiskCache(str(tmpdir), max_bytes=250)
+    a, b, c = map(cache_key, 'abc')
+    cache.put(a, {'x': 'a' * 100})
+    cache.put(b, {'x': 'b' * 100})
+    os.utime(os.path.join(str(tmpdir), a), (0, 0))
+    os.utime(os.path.join(str(tmpdir), b), (1, 1))
+    assert cache.get(a) # now a is more recently used than b
+    cache.put(c, {'x': 'c' * 100})
+    assert cache.get(b) is None
+    assert cache.get(a) and cache.get(c)
+
+def test_running_size(tmpdir):
+    cache = DiskCache(str(tmpdir), max_bytes=250)
+    size_file = tmpdir.join('.size')
+    cache.put(cache_key('a'), {'x': 'a' * 100, 'y': 'a'})
+    assert size_file.read() == '101'
+    cache.put(cache_key('a'), {'x': 'a' * 100, 'y': 'a'}) # already there
+    cache.put(cache_key('b'), {'x': 'b' * 100})
+    assert size_file.read() == '201'
+    # it's only an estimate; crossing the limit recounts
+    size_file.write('1000')
+    cache.put(cache_key('c'), {'x': 'c' * 10})
+    assert size_file.read() == '211'
+    assert cache.get(cache_key('a')) == {'x': 'a' * 100, 'y': 'a'}
+    # the size file isn't an entry to evict
+    cache.put(cache_key('d'), {'x': 'd' * 100})
+    assert size_file.check()
+    assert sorted(cache.keys()) == sorted(map(cache_key, 'acd'))
@@ -0,0 +1,25 @@
+import logging as log
+from StringIO import StringIO
+
+from converter import docerror
+
+def test_recording_log_is_independent_of_verbosity():
+    root = log.getLogger()
+    old_handlers, old_level = root.handlers[:], root.level
+    console = StringIO()
+    root.handlers[:] = [log.StreamHandler(console)]
+    root.setLevel(log.ERROR)
+    try:
+        with docerror.recording_log() as records:
+            log.info('some info')
+            log.getLogger('chatty.library').debug('noise')
+            log.error('an error')
+        # the console sees just what it did before
+        assert console.getvalue() == 'an error\n'
+        assert [r.getMessage() for r in records] == ['some info', 'an error']
+        root.setLevel(log.INFO)
+        docerror.replay_log(records)
+        assert console.getvalue() == 'an error\nsome info\nan error\n'
+    finally:
+        root.handlers[:] = old_handlers
+        root.setLevel(old_level)
@@ -0,0 +1,101 @@
+import cPickle as pickle
+import logging as log
+import os
+from StringIO import StringIO
+import zipfile
+
+from converter import exit_code, gdoc_converter, scheduler
+from converter.diskcache import DiskCache, cache_key
+import synthetic
+
+def fake_parse(**kwargs):
+    log.warn('Odd document %s', kwargs['infilename'])
+    return None, {}, ['body'], None, lambda meta: None
+
+def test_cached_parse_replays_for_any_verbosity(tmpdir, monkeypatch):
+    monkeypatch.setattr(gdoc_converter, 'parse', fake_parse)
+    stage_cache = DiskCache(str(tmpdir), max_bytes=2**20)
+    root = log.getLogger()
+    old_handlers, old_level = root.handlers[:], root.level
+    console = StringIO()
+    root.handlers[:] = [log.StreamHandler(console)]
+    try:
+        root.setLevel(log.CRITICAL) # -q
+        parsed = gdoc_converter.cached_parse(stage_cache, cache_key('doc'),
+                                             infilename='doc.odt')
+        assert parsed[2] == ['body'] and console.getvalue() == ''
+        root.setLevel(log.WARNING) # -vv
+        parsed = gdoc_converter.cached_parse(stage_cache, cache_key('doc'),
+                                             infilename='doc.odt')
+        assert parsed[2] == ['body'] and parsed[4] is None
+        assert console.getvalue() == 'Odd document doc.odt\n'
+    finally:
+        root.handlers[:] = old_handlers
+        root.setLevel(old_level)
+
+STYLE_BASE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          '..', '..', 'styles')
+
+class FakeStyle(object):
+    base_path = STYLE_BASE
+
+def test_build_pdf_twice_in_build_dir(tmpdir, monkeypatch):
+    builds = []
+    def fake_build(argv, cwd, stdout):
+        with open(argv[0]) as f:
+            assert 'doc.tex' in f.read()
+        builds.append(cwd)
+        tmpdir.join('build', 'doc.pdf').write('%PDF ' + str(len(builds)))
+    monkeypatch.setattr(scheduler, 'build', fake_build)
+    src, build_dir = tmpdir.mkdir('src'), tmpdir.mkdir('build')
+    tex = src.join('doc.tex')
+    for i in range(2):
+        tex.write('\\documentclass{article} %% %d' % i)
+        pdf = gdoc_converter._build_pdf(str(tex), FakeStyle(), str(build_dir),
+                                        preview=False)
+        assert open(pdf).read() == '%PDF ' + str(i + 1)
+    assert builds == [str(build_dir)] * 2
+    assert os.access(str(build_dir.join('makepdf')), os.X_OK)
+
+def test_several_pages_need_a_zip(tmpdir):
+    out_prefix = str(tmpdir.join('out'))
+    with gdoc_converter._provide_format_outfile(out_prefix, 'png', None,
+                                                [1, 2]) as f:
+        assert f.name == out_prefix + '.png.zip'
+    with gdoc_converter._provide_format_outfile(out_prefix, 'png', None,
+                                                [1]) as f:
+        assert f.name == out_prefix + '.png'
+    tmpdir.join('out.png').remove()
+    args = gdoc_converter.parse_args(['--page', '1-3', 'in.odt',
+                                      out_prefix + '.png'])
+    try:
+        gdoc_converter.convert(args)
+    except SystemExit as e:
+        assert e.code == exit_code.USAGE_ERROR_EXIT
+    else:
+        assert False, 'no usage error'
+    assert not tmpdir.join('out.png').check()
+
+def test_convert_synthetic_table(tmpdir):
+    odt = str(tmpdir.join('table.odt'))
+    synthetic.make_odt(odt, synthetic.Size(table_rows=3, table_cols=2))
+    args = gdoc_converter.parse_args([
+        '--format', 'html,tex', '--style-base', STYLE_BASE,
+        '--style', 'typesetr/default', odt, str(tmpdir.join('out'))])
+    gdoc_converter.convert(args)
+    for ext in 'html', 'tex':
+        assert 'Column 2' in tmpdir.join('out.' + ext).read()
+
+def test_replay_renames_zipped_outputs(tmpdir):
+    zipped = StringIO()
+    with zipfile.ZipFile(zipped, 'w') as archive:
+        for fn in 'doc.tex', 'doc.aux', 'doc-1.png', 'doc_logo.png':
+            archive.writestr(fn, fn)
+    cached = dict(tex=zipped.getvalue(), name='doc', exit_code='0',
+                  diagnostics=pickle.dumps([]))
+    gdoc_converter._replay_result(cached, ['tex'], None,
+                                  str(tmpdir.join('out')), 'zip', [1])
+    with zipfile.ZipFile(str(tmpdir.join('out.tex.zip'))) as archive:
+        assert archive.namelist() == ['out.tex', 'out.aux', 'out-1.png',
+                                      'doc_logo.png']
+        assert archive.read('out.tex') == 'doc.tex'
@@ -1,6 +1,8 @@
 #-*- file-encoding: utf-8 -*-
+import copy
+
 from converter.internal import mkel
-from converter.html_writer import _indent, write_body
+from converter.html_writer import _indent, iter_body, write_body
 from converter.sectionize import sectionize
 
 # don't complain about long names: pylint: disable=C0103
@@ -106,3 +108,8 @@ def test_indent():
 
 def test_write_body():
     assert write_body([mkel('script', {}, [])])
+
+def test_iter_body():
+    for body in [BODY, WEIRD_BODY, [' \n '], ['x  \n', '\n\n  y \n'], []]:
+        assert ''.join(iter_body(copy.deepcopy(body))) == write_body(
+            copy.deepcopy(body))
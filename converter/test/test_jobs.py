@@ -0,0 +1,28 @@
+import json
+
+from converter import exit_code, jobs
+
+def fake_run_job(argv):
+    return {'argv': argv, 'exit_code': int(argv[0])}
+
+def test_run_batch_exit_code(tmpdir, monkeypatch, capsys):
+    # the pool's workers are forked, so they see the fake too
+    monkeypatch.setattr(jobs, 'run_job', fake_run_job)
+    manifest = tmpdir.join('jobs.json')
+    def run(*codes):
+        manifest.write(''.join(json.dumps({'args': [str(code)]}) + '\n'
+                               for code in codes))
+        combined = jobs.run_batch(str(manifest), processes=2)
+        # one result line per job, in manifest order
+        results = [json.loads(line)
+                   for line in capsys.readouterr()[0].splitlines()]
+        assert [r['exit_code'] for r in results] == list(codes)
+        assert [r['argv'] for r in results] == [[str(code)] for code in codes]
+        return combined
+    data_errors = exit_code.META_ERROR_EXIT | exit_code.BODY_ERROR_EXIT
+    assert run(0, exit_code.META_ERROR_EXIT,
+               exit_code.BODY_ERROR_EXIT) == data_errors
+    assert run(exit_code.BODY_ERROR_EXIT,
+               exit_code.INTERNAL_ERROR_EXIT) == exit_code.INTERNAL_ERROR_EXIT
+    assert run(exit_code.USAGE_ERROR_EXIT, exit_code.META_ERROR_EXIT,
+               0) == exit_code.USAGE_ERROR_EXIT
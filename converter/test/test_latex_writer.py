@@ -0,0 +1,61 @@
+import logging as log
+
+from converter import docerror
+from converter.latex_writer import (
+    LatexWriter, parallel_latexify, split_sections)
+
+BODY = [
+    ('h1', {}, ['Intro']),
+    ('p', {}, ['Some ', ('b', {}, ['bold']), ' text & more']),
+    ('ul', {}, [('li', {}, ['one']), ('li', {}, ['two'])]),
+    ('h2', {}, ['Details']),
+    'a plain string\n',
+    ('p', {}, ['See ', ('a', {'href': 'http://example.com/~x'}, ['here'])]),
+    ('h1', {}, ['End']),
+    ('p', {}, []),
+    ]
+
+def test_iter_latexify():
+    for body in [BODY, BODY[:3], BODY[:5], BODY[-1:], ['\n', '\n'], []]:
+        assert u''.join(LatexWriter().iter_latexify(body)) == (
+            LatexWriter().latexify(body))
+
+def test_split_sections():
+    front, sections = split_sections(BODY)
+    assert front == []
+    assert [s[0][2] for s in sections] == [['Intro'], ['End']]
+    assert split_sections(BODY[1:3]) == (BODY[1:3], [])
+
+def url(href):
+    return ('p', {}, [('a', {'href': href}, [href])])
+
+def test_parallel_latexify():
+    body = [url('http://example.com/%d' % i) for i in range(12)]
+    for i in range(0, 12, 3):
+        body.insert(i, ('h1', {}, ['Section %d' % i]))
+    serial, parallel = LatexWriter(), LatexWriter()
+    assert u''.join(parallel_latexify(parallel, body, 4)) == u''.join(
+        serial.iter_latexify(body))
+    assert parallel.urldefs == serial.urldefs
+    assert len(serial.urldefs) == 12
+
+def bad_command(name):
+    return ('p', {}, [('CMD', {'class': [name]}, [])])
+
+def test_parallel_latexify_with_problems():
+    body = [url('http://example.com/%d' % i) for i in range(12)]
+    for i in range(0, 12, 3):
+        body.insert(i, ('h1', {}, ['Section %d' % i]))
+    body.insert(5, bad_command('foo'))
+    body.insert(12, bad_command('bar'))
+    body.insert(13, bad_command('baz'))
+    def latexify(processes):
+        docerror.ERROR_COUNT = 0
+        writer = LatexWriter()
+        with docerror.recording_log() as records:
+            latex = u''.join(parallel_latexify(writer, body, processes))
+        return latex, writer.urldefs, [r.getMessage() for r in records
+                                       if r.levelno > log.DEBUG]
+    serial, parallel = latexify(1), latexify(4)
+    assert parallel == serial
+    assert 'docproblem3' in serial[0] and 'docproblem4' not in serial[0]
@@ -0,0 +1,47 @@
+import os
+
+from converter import latexbuild
+
+def test_sync_tree(tmpdir):
+    src, dst = tmpdir.mkdir('src'), tmpdir.mkdir('dst')
+    src.join('doc.tex').write('\\documentclass{article}')
+    tmpdir.join('typesetr.sty').write('%')
+    src.mkdir('include').join('typesetr.sty').mksymlinkto(
+        tmpdir.join('typesetr.sty'))
+    dst.join('doc.aux').write('\\relax')
+    assert latexbuild.sync_tree(str(src), str(dst)) == 2
+    assert dst.join('include', 'typesetr.sty').islink()
+    assert dst.join('include', 'typesetr.sty').read() == '%'
+    # unchanged files are left alone, build artifacts survive
+    src.join('doc.tex').write('\\documentclass{book}')
+    assert latexbuild.sync_tree(str(src), str(dst)) == 1
+    assert dst.join('doc.tex').read() == '\\documentclass{book}'
+    assert dst.join('doc.aux').read() == '\\relax'
+
+def test_build_dir(tmpdir):
+    a = latexbuild.build_dir(str(tmpdir), 'doc', 'typesetr/HTML5')
+    assert os.path.isdir(a)
+    assert a == latexbuild.build_dir(str(tmpdir), 'doc', 'typesetr/HTML5')
+    assert a != latexbuild.build_dir(str(tmpdir), 'doc', 'typesetr/Epub-3.0')
+
+def test_include_only(tmpdir):
+    src, dst = tmpdir.mkdir('src'), tmpdir.mkdir('dst')
+    for d in src, dst:
+        d.join('chapter-001.tex').write('\\section{A}')
+    src.join('chapter-002.tex').write('\\section{B}')
+    assert latexbuild.changed_files(
+        str(src), str(dst), ['chapter-001.tex', 'chapter-002.tex']) == [
+            'chapter-002.tex']
+    src.join('doc.tex').write('\\documentclass{book}\n\\begin{document}\n'
+                              '\\include{chapter-001}\n\\end{document}\n')
+    latexbuild.include_only(str(src.join('doc.tex')), ['chapter-002'])
+    assert src.join('doc.tex').read().startswith(
+        '\\documentclass{book}\n\\includeonly{chapter-002}\n'
+        '\\begin{document}\n')
+    src.join('broken.tex').write('\\documentclass{book}\n')
+    try:
+        latexbuild.include_only(str(src.join('broken.tex')), ['chapter-002'])
+    except ValueError as e:
+        assert 'has no \\begin{document}' in str(e)
+    else:
+        assert False, 'no error'
@@ -0,0 +1,21 @@
+import subprocess
+
+import pytest
+
+from converter import scheduler
+
+def test_slot(tmpdir):
+    with scheduler.slot(2, str(tmpdir)):
+        with scheduler.slot(2, str(tmpdir)):
+            # both slots taken
+            assert scheduler._try_lock(str(tmpdir.join('slot-0'))) is None
+            assert scheduler._try_lock(str(tmpdir.join('slot-1'))) is None
+    assert scheduler._try_lock(str(tmpdir.join('slot-0')))
+
+def test_run():
+    scheduler.run(['true'])
+    with pytest.raises(subprocess.CalledProcessError):
+        scheduler.run(['false'])
+    with pytest.raises(scheduler.BuildTimeout):
+        scheduler.run(['sleep', '10'], timeout=0.2)
+    assert not scheduler._RUNNING
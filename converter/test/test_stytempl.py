@@ -0,0 +1,55 @@
+import logging as log
+import os
+
+from converter.stytempl import StyleTemplate
+
+def make_style(tmpdir):
+    style = tmpdir.mkdir('typesetr').mkdir('doc')
+    style.join('metadata.yml').write('title:\n  type: text\n')
+    tmpdir.mkdir('shared').mkdir('fallbacks')
+    return StyleTemplate(str(tmpdir), str(style), gdoc_meta={})
+
+class Recorder(log.Handler):
+    def __init__(self):
+        log.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def test_for_document(tmpdir):
+    template = make_style(tmpdir)
+    a = template.for_document({'title': 'A'})
+    b = template.for_document({'title': 'B'})
+    assert a.meta_schema.augment_with_defaults({})['title'] == 'A'
+    assert b.meta_schema.augment_with_defaults({})['title'] == 'B'
+    assert template.meta_schema.augment_with_defaults({})['title'] == ''
+    assert a.hexdigest() == b.hexdigest() == template.hexdigest()
+    # every document gets told about missing formats
+    recorder = Recorder()
+    log.getLogger().addHandler(recorder)
+    try:
+        a.format_dir('epub')
+        a.format_dir('epub')
+        b.format_dir('epub')
+    finally:
+        log.getLogger().removeHandler(recorder)
+    assert len([m for m in recorder.messages if 'not supported' in m]) == 2
+
+def test_changed_on_disk(tmpdir):
+    template = make_style(tmpdir)
+    digest = template.hexdigest()
+    assert not template.changed_on_disk()
+    metadata = tmpdir.join('typesetr', 'doc', 'metadata.yml')
+    metadata.write('title:\n  type: text\nauthor:\n  type: text\n')
+    os.utime(str(metadata), (0, 0))
+    assert template.changed_on_disk()
+    assert template.hexdigest() != digest
+
+def test_formats_are_not_style_files(tmpdir):
+    template = make_style(tmpdir)
+    digest = template.hexdigest()
+    tmpdir.join('shared', 'fallbacks').mkdir('latex').mkdir('format').join(
+        'en.fmt').write('dumped')
+    assert not template.changed_on_disk()
+    assert template.hexdigest() == digest
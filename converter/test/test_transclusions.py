@@ -0,0 +1,75 @@
+import cStringIO
+
+import PIL.Image
+
+from converter import transclusions as transclusions_module
+from converter.transclusions import (
+    Transclusions, print_widths_cm, resample_for_print, TEXTWIDTH_CM,
+    to_data_url, from_data_url)
+
+def png(width, height, mode='RGB', format='png', **kwargs):
+    out = cStringIO.StringIO()
+    PIL.Image.new(mode, (width, height)).save(out, format, **kwargs)
+    return out.getvalue()
+
+def fig(src, width='50%', **attrs):
+    return ('figure', dict(attrs, style={'display': 'block', 'width': width}),
+            [('img', {'src': src}, [])])
+
+def test_print_widths_cm():
+    body = [fig('a.png'), ('blockquote', {}, [fig('a.png', '25%')]),
+            fig('b.png', '100%', **{'class': ['fullwidth']}),
+            ('p', {}, ['logo: ', ('img', {'src': 'c.png'}, [])]),
+            fig('c.png')]
+    assert print_widths_cm(body) == {'a.png': TEXTWIDTH_CM / 2,
+                                     'b.png': TEXTWIDTH_CM * 1.5}
+    assert print_widths_cm(body, 2*TEXTWIDTH_CM)['a.png'] == TEXTWIDTH_CM
+
+def test_resample_for_print(tmpdir):
+    data = png(4000, 3000)
+    # 2.54cm at 4000dpi is all of its 4000 pixels
+    assert resample_for_print(data, 2.54, 4000) is None
+    small = resample_for_print(data, 2.54, 300)
+    im = PIL.Image.open(cStringIO.StringIO(small))
+    assert (im.format, im.size, im.mode) == ('PNG', (300, 225), 'RGB')
+    transclusions = Transclusions({})
+    href = transclusions.add_raw_data('big.png', data)
+    href = transclusions.normalize_known_transclusion(href)
+    transclusions.out_dir = str(tmpdir)
+    transclusions.provide({href: 2.54}, 300)
+    assert tmpdir.join(href).read('rb') == small
+    # the original is kept, e.g. for html
+    assert transclusions.get_data(href) == data
+
+def test_resample_modes():
+    def resampled(data):
+        small = resample_for_print(data, 2.54, 300)
+        return small and PIL.Image.open(cStringIO.StringIO(small))
+    im = resampled(png(4000, 3000, 'P', transparency=0))
+    assert im.size == (300, 225) and im.mode == 'RGBA'
+    im = resampled(png(4000, 3000, 'LA'))
+    assert im.size == (300, 225) and im.mode == 'LA'
+    im = resampled(png(4000, 3000, format='jpeg'))
+    assert (im.format, im.size, im.mode) == ('JPEG', (300, 225), 'RGB')
+    # might be animated
+    assert resampled(png(4000, 3000, 'P', format='gif')) is None
+
+def test_data_urls(monkeypatch):
+    transclusions = Transclusions({})
+    hrefs = [transclusions.normalize_known_transclusion(
+        transclusions.add_raw_data('%d.png' % i, png(100 + i, 100)))
+             for i in range(3)]
+    url = transclusions.known_transclusion_to_data_url(hrefs[0])
+    assert url == 'data:image/png;base64,' + (
+        transclusions.get_data(hrefs[0]).encode('base64').replace('\n', ''))
+    assert from_data_url(url) == (transclusions.get_data(hrefs[0]),
+                                  'image/png')
+    assert transclusions.known_transclusion_to_data_url(hrefs[0]) is url
+    assert transclusions.known_transclusion_to_data_url('x.png') == 'x.png'
+    # the memo is bounded
+    monkeypatch.setattr(transclusions_module, 'DATA_URL_CACHE_BYTES',
+                        2 * len(url) + 100)
+    for href in hrefs:
+        assert transclusions.known_transclusion_to_data_url(href) == (
+            to_data_url(transclusions.get_data(href), 'image/png'))
+    assert list(transclusions._data_urls) == hrefs[1:]